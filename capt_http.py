@@ -0,0 +1,369 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from dataclasses import asdict, dataclass, replace
+from typing import Any
+
+import urllib3 as url
+
+import metrics
+
+CACHE_DIR = "env/http_cache"
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+# Seconds between two measures of the cache on disk
+EVICT_INTERVAL = 60.0
+
+# Upper bound on concurrent requests to capt.gov.kw, each crawl worker holds at most
+# one request at a time so this also bounds the size of the crawl's worker pool.
+MAX_IN_FLIGHT = 8
+
+DEFAULT_HEADERS = url.make_headers(keep_alive=True, accept_encoding=True)
+
+# Requests per second allowed towards capt.gov.kw and how many can be sent at once
+RATE_LIMIT = 4.0
+BURST = 8
+# Attempts after the first one, the n-th retry waits `BACKOFF * 2 ** n` seconds
+RETRIES = 4
+BACKOFF = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+REQUEST_TIMEOUT = url.Timeout(connect=10, read=60)
+# Leave the retrying to the scheduler but keep following the redirects
+NO_RETRY = url.Retry(total=None, connect=0, read=0, other=0, status=0, redirect=10)
+# Latency above which the scheduler stops opening up concurrency
+TARGET_LATENCY = 2.0
+
+
+@dataclass
+class CacheEntry:
+    url: str
+    digest: str
+    size: int
+    etag: str = ""
+    last_modified: str = ""
+    fetched: float = 0.0
+
+
+class CachedResponse:
+    """The subset of `urllib3.BaseHTTPResponse` used by the parsers, `from_cache` is set
+    when the body was served from the cache after a revalidation."""
+
+    def __init__(self, status: int, data: bytes, headers: Any, from_cache=False):
+        self.status = status
+        self.data = data
+        self.headers = headers
+        self.from_cache = from_cache
+
+
+class ResponseCache:
+    """A size bounded on-disk store of response bodies keyed by URL, every entry is a
+    `<sha256(url)>.body` file next to its `<sha256(url)>.json` metadata.
+
+    The metadata is read from the disk, and read again whenever its file changed, so
+    the processes sharing `directory` see the entries the others wrote. Once the
+    bodies on disk exceed `max_bytes` the least recently used ones, by modification
+    time, are evicted. The disk is measured when the bodies written by this process
+    may have crossed `max_bytes` and at least every `EVICT_INTERVAL` seconds, so the
+    bound can be exceeded by what other processes wrote in between.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: dict[str, tuple[tuple[int, int], CacheEntry]] = {}
+        self._usage = 0
+        self._measured = float("-inf")
+
+    def _path(self, key: str, ext: str) -> str:
+        return os.path.join(self.directory, f"{key}.{ext}")
+
+    def get(self, link: str) -> CacheEntry | None:
+        key = key_of(link)
+        path = self._path(key, "json")
+        try:
+            stat = os.stat(path)
+            stamp = (stat.st_mtime_ns, stat.st_size)
+            with self._lock:
+                if key in self._entries and self._entries[key][0] == stamp:
+                    return self._entries[key][1]
+            with open(path, encoding="utf-8") as file:
+                entry = CacheEntry(**json.load(file))
+        except (OSError, ValueError, TypeError):
+            with self._lock:
+                self._entries.pop(key, None)
+            return None
+        with self._lock:
+            self._entries[key] = (stamp, entry)
+        return entry
+
+    def read(self, link: str) -> bytes | None:
+        key = key_of(link)
+        try:
+            with open(self._path(key, "body"), "rb") as file:
+                body = file.read()
+        except OSError:
+            return None
+        self.touch(link)
+        return body
+
+    def touch(self, link: str):
+        """Mark the entry of `link` as the most recently used one"""
+        try:
+            os.utime(self._path(key_of(link), "body"))
+        except OSError:
+            pass
+
+    def _write(self, key: str, ext: str, content: bytes):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self._path(key, f"{ext}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "wb") as file:
+            file.write(content)
+        os.replace(tmp, self._path(key, ext))
+
+    def put(self, entry: CacheEntry, body: bytes | None = None):
+        """Store `entry`, only its metadata is rewritten when `body` is omitted"""
+        key = key_of(entry.url)
+        if body is not None:
+            self._write(key, "body", body)
+        self._write(key, "json", json.dumps(asdict(entry), ensure_ascii=False).encode())
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._usage += len(body or b"")
+            if (
+                self._usage > self.max_bytes
+                or time.monotonic() - self._measured >= EVICT_INTERVAL
+            ):
+                self._evict()
+
+    def _evict(self):
+        bodies = []
+        try:
+            with os.scandir(self.directory) as scan:
+                for item in scan:
+                    if item.name.endswith(".body"):
+                        try:
+                            stat = item.stat()
+                        except OSError:
+                            continue
+                        bodies.append((stat.st_mtime_ns, stat.st_size, item.name))
+        except OSError:
+            return
+
+        self._usage = sum(size for _, size, _ in bodies)
+        self._measured = time.monotonic()
+        for _, size, name in sorted(bodies):
+            if self._usage <= self.max_bytes:
+                break
+            key = name[: -len(".body")]
+            self._usage -= size
+            self._entries.pop(key, None)
+            for ext in ("body", "json"):
+                try:
+                    os.remove(self._path(key, ext))
+                except OSError:
+                    pass
+
+
+class CachedClient:
+    """Sends conditional `GET`s using the validators stored in `cache`, a `304` or a
+    body identical to the cached one is answered from the cache. A `GET` given a
+    `max_age` is answered from the cache without any request when the entry was
+    (re)validated less than `max_age` seconds ago. Any other method is passed
+    through to `pool`.
+    """
+
+    def __init__(self, pool, cache: ResponseCache):
+        self.pool = pool
+        self.cache = cache
+
+    def request(self, method: str, link: str, headers=None, max_age=0.0, **kwargs):
+        """Observes the `http_request_seconds` of every request, labelled with its
+        status and whether it was answered from the cache"""
+        start = time.perf_counter()
+        try:
+            response = self._request(method, link, headers, max_age, **kwargs)
+        except Exception as e:
+            metrics.inc("http_errors_total", error=type(e).__name__)
+            raise
+        metrics.observe(
+            "http_request_seconds",
+            time.perf_counter() - start,
+            status=str(response.status),
+            cached=str(getattr(response, "from_cache", False)).lower(),
+        )
+        return response
+
+    def _request(self, method: str, link: str, headers, max_age, **kwargs):
+        headers = {**DEFAULT_HEADERS, **(headers or {})}
+        if method != "GET":
+            return self.pool.request(method, link, headers=headers, **kwargs)
+
+        entry = self.cache.get(link)
+        if entry and time.time() - entry.fetched < max_age:
+            if (body := self.cache.read(link)) is not None:
+                return CachedResponse(200, body, {}, from_cache=True)
+
+        if entry:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+
+        response = self.pool.request(method, link, headers=headers, **kwargs)
+
+        if response.status == 304 and entry:
+            if (body := self.cache.read(link)) is not None:
+                self.cache.put(replace(entry, fetched=time.time()))
+                return CachedResponse(200, body, response.headers, from_cache=True)
+            # the body vanished from the disk, refetch it unconditionally
+            entry = None
+            headers.pop("If-None-Match", None)
+            headers.pop("If-Modified-Since", None)
+            response = self.pool.request(method, link, headers=headers, **kwargs)
+
+        if response.status != 200:
+            return response
+
+        digest = hashlib.sha256(response.data).hexdigest()
+        if entry and entry.digest == digest:
+            self.cache.put(replace(entry, fetched=time.time()))
+            return CachedResponse(200, response.data, response.headers, from_cache=True)
+
+        self.cache.put(
+            CacheEntry(
+                url=link,
+                digest=digest,
+                size=len(response.data),
+                etag=response.headers.get("ETag", ""),
+                last_modified=response.headers.get("Last-Modified", ""),
+                fetched=time.time(),
+            ),
+            response.data,
+        )
+        return response
+
+
+class RequestScheduler:
+    """Sends the requests of all the threads through `pool` under a token bucket of
+    `rate` requests per second, retrying timeouts, connection errors and
+    `RETRY_STATUSES` with exponential backoff.
+
+    The number of concurrent requests is adjusted from the observed latency and
+    errors, it grows by one request per round of successes faster than
+    `TARGET_LATENCY` and is halved on a slow or failed request, the rate follows the
+    same scheme between `rate / 8` and `rate`.
+    """
+
+    def __init__(
+        self,
+        pool,
+        rate=RATE_LIMIT,
+        burst=BURST,
+        max_concurrency=MAX_IN_FLIGHT,
+        retries=RETRIES,
+        backoff=BACKOFF,
+    ):
+        self.pool = pool
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.concurrency = float(max_concurrency)
+        self.retries = retries
+        self.backoff = backoff
+        self.in_flight = 0
+        self.queue_depth = 0
+        self.latency = 0.0
+        self.error_rate = 0.0
+        self._tokens = float(burst)
+        self._refilled = time.monotonic()
+        self._cond = threading.Condition()
+
+    def stats(self) -> dict[str, float]:
+        with self._cond:
+            return {
+                "rate": round(self.rate, 3),
+                "concurrency": int(self.concurrency),
+                "in_flight": self.in_flight,
+                "queue_depth": self.queue_depth,
+                "latency": round(self.latency, 3),
+                "error_rate": round(self.error_rate, 3),
+            }
+
+    def _acquire(self):
+        start = time.perf_counter()
+        with self._cond:
+            self.queue_depth += 1
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._refilled) * self.rate
+                )
+                self._refilled = now
+                if self.in_flight < int(self.concurrency) and self._tokens >= 1:
+                    break
+                wait = None if self._tokens >= 1 else (1 - self._tokens) / self.rate
+                self._cond.wait(wait)
+            self._tokens -= 1
+            self.queue_depth -= 1
+            self.in_flight += 1
+        metrics.observe("http_wait_seconds", time.perf_counter() - start)
+
+    def _release(self, latency: float, failed: bool):
+        with self._cond:
+            self.in_flight -= 1
+            self.latency = (
+                latency if not self.latency else 0.8 * self.latency + 0.2 * latency
+            )
+            self.error_rate = 0.8 * self.error_rate + 0.2 * failed
+            if failed or latency > TARGET_LATENCY:
+                self.concurrency = max(1.0, self.concurrency / 2)
+                self.rate = max(self.max_rate / 8, self.rate / 2)
+            else:
+                self.concurrency = min(
+                    self.max_concurrency, self.concurrency + 1 / self.concurrency
+                )
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 16)
+            self._cond.notify_all()
+
+    def request(self, method: str, link: str, **kwargs):
+        kwargs.setdefault("timeout", REQUEST_TIMEOUT)
+        for retry in range(self.retries + 1):
+            self._acquire()
+            start = time.monotonic()
+            response, error = None, None
+            try:
+                response = self.pool.request(method, link, retries=NO_RETRY, **kwargs)
+            except (url.exceptions.HTTPError, OSError) as e:
+                error = e
+            failed = error is not None or response.status in RETRY_STATUSES  # type: ignore
+            self._release(time.monotonic() - start, failed)
+
+            if not failed or retry == self.retries:
+                break
+
+            delay = self.backoff * 2**retry * random.uniform(1, 1.5)
+            if (
+                response is not None
+                and (after := response.headers.get("Retry-After", "")).isdigit()
+            ):
+                delay = max(delay, float(after))
+            print(f"RETRYING in {delay:.1f}s: {link} ({error or response.status})")  # type: ignore
+            metrics.inc("http_retries_total")
+            time.sleep(delay)
+
+        if error:
+            raise error
+        return response
+
+
+def key_of(link: str) -> str:
+    return hashlib.sha256(link.encode()).hexdigest()
+
+
+scheduler = RequestScheduler(url.PoolManager(maxsize=MAX_IN_FLIGHT, block=True))
+http = CachedClient(scheduler, ResponseCache())
@@ -0,0 +1,201 @@
+"""Record the CAPT pages fetched by a crawl and replay them from a local stand-in.
+
+    python capt_replay.py record [max_in_flight]
+    python capt_replay.py serve [--port PORT] [--latency S] [--jitter S]
+    python capt_replay.py bench [--levels 1 4 8 16] [--latency S] [--jitter S]
+
+`record` crawls the live site into `FIXTURES_DIR`, the snapshot of that crawl is
+kept next to the pages as the reference the replayed crawls are compared to. The
+crawler is pointed at a running stand-in through the `CAPT_WEBSITE` environment
+variable, e.g. `CAPT_WEBSITE=http://127.0.0.1:8642/en python snif_mice.py refresh`.
+"""
+import contextlib
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import urllib3 as url
+
+import snif_mice
+from capt_http import CachedClient, RequestScheduler, ResponseCache
+
+FIXTURES_DIR = "env/fixtures"
+REFERENCE_SNAPSHOT = "tenders.json"
+PORT = 8642
+
+
+def fixture_key(link: str) -> str:
+    """The fixture name of `link`, only its path and query are kept so the pages can
+    be replayed from any host"""
+    parts = urlsplit(link)
+    path = f"{parts.path}?{parts.query}" if parts.query else parts.path
+    return hashlib.sha256(path.encode()).hexdigest()
+
+
+class RecordingClient:
+    """Passes the requests through to `client` and stores every successful response
+    body in `directory`"""
+
+    def __init__(self, client, directory=FIXTURES_DIR):
+        self.client = client
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def request(self, method, link, headers=None, **kwargs):
+        response = self.client.request(method, link, headers=headers, **kwargs)
+        if response.status == 200:
+            key = fixture_key(link)
+            with open(os.path.join(self.directory, f"{key}.body"), "wb") as file:
+                file.write(response.data)
+            with open(
+                os.path.join(self.directory, f"{key}.json"), "w", encoding="utf-8"
+            ) as file:
+                json.dump(
+                    {
+                        "url": link,
+                        "content_type": response.headers.get("Content-Type", ""),
+                    },
+                    file,
+                )
+        return response
+
+
+def make_server(directory=FIXTURES_DIR, port=PORT, latency=0.0, jitter=0.0):
+    """A threaded HTTP server answering with the pages recorded in `directory`, each
+    response is delayed by `latency` plus up to `jitter` seconds. `server.hits`
+    counts the requests served."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            with lock:
+                server.hits += 1
+            time.sleep(latency + random.uniform(0, jitter))
+            key = fixture_key(self.path)
+            try:
+                with open(os.path.join(directory, f"{key}.body"), "rb") as file:
+                    body = file.read()
+                with open(
+                    os.path.join(directory, f"{key}.json"), encoding="utf-8"
+                ) as file:
+                    content_type = json.load(file)["content_type"]
+            except OSError:
+                self.send_error(404, f"no recorded page for {self.path}")
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", content_type or "text/html")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    lock = threading.Lock()
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.hits = 0  # type: ignore
+    return server
+
+
+def record(max_in_flight=1, directory=FIXTURES_DIR):
+    snif_mice.http = RecordingClient(snif_mice.http, directory)
+    snif_mice.save_snapshot(
+        os.path.join(directory, REFERENCE_SNAPSHOT),
+        max_in_flight=max_in_flight,
+        resume=False,
+    )
+
+
+def bench(levels=(1, 4, 8, 16), latency=0.05, jitter=0.02, directory=FIXTURES_DIR):
+    """Crawl the recorded pages at each concurrency level of `levels`, reporting the
+    pages per second and the parse time per page"""
+    server = make_server(directory, 0, latency, jitter)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    snif_mice.CAPT_WEBSITE = f"http://127.0.0.1:{server.server_address[1]}/en"
+
+    parse_page = snif_mice.parse_page
+    parsing = {"pages": 0, "seconds": 0.0}
+    lock = threading.Lock()
+
+    def timed_parse_page(*args, **kwargs):
+        start = time.perf_counter()
+        res = parse_page(*args, **kwargs)
+        with lock:
+            parsing["pages"] += 1
+            parsing["seconds"] += time.perf_counter() - start
+        return res
+
+    snif_mice.parse_page = timed_parse_page
+    snif_mice.MAX_IN_FLIGHT = max(levels)
+    with open(os.path.join(directory, REFERENCE_SNAPSHOT), encoding="utf-8") as file:
+        reference = file.read()
+
+    high_sep = "━" * 88
+    print(high_sep)
+    print(f"Crawling {directory} with {latency}s latency and {jitter}s jitter")
+    print(high_sep)
+    for level in levels:
+        with tempfile.TemporaryDirectory() as tmp:
+            scheduler = RequestScheduler(
+                url.PoolManager(maxsize=level, block=True),
+                rate=1e6,
+                burst=level,
+                max_concurrency=level,
+            )
+            snif_mice.http = CachedClient(scheduler, ResponseCache(tmp))
+            parsing.update(pages=0, seconds=0.0)
+            server.hits = 0  # type: ignore
+
+            start = time.perf_counter()
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                snif_mice.save_snapshot(
+                    os.path.join(tmp, REFERENCE_SNAPSHOT),
+                    max_in_flight=level,
+                    resume=False,
+                )
+            duration = time.perf_counter() - start
+
+            with open(os.path.join(tmp, REFERENCE_SNAPSHOT), encoding="utf-8") as file:
+                identical = file.read() == reference
+
+        print(
+            f"max_in_flight = {level:>3} :: {duration:8.2f} s, "
+            f"{server.hits / duration:8.2f} pages/s, "  # type: ignore
+            f"{1000 * parsing['seconds'] / max(1, parsing['pages']):6.2f} ms parse/page, "
+            f"identical = {identical}"
+        )
+    print(high_sep)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["record", "serve", "bench"])
+    parser.add_argument("max_in_flight", nargs="?", type=int, default=1)
+    parser.add_argument("--dir", default=FIXTURES_DIR)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 4, 8, 16])
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record(args.max_in_flight, args.dir)
+    elif args.command == "serve":
+        server = make_server(args.dir, args.port, args.latency, args.jitter)
+        print(f"Serving {args.dir} on http://127.0.0.1:{args.port}/en")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            sys.exit(0)
+    elif args.command == "bench":
+        bench(args.levels, args.latency, args.jitter, args.dir)
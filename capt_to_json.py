@@ -1,13 +1,13 @@
 import json
 import sys
+from snapshot import load_snapshot
 from snif_mice import save_snapshot
 
 def open_tenders_file(file_path="env/tenders.json", refresh=False):
     if refresh:
         save_snapshot(file_path)
 
-    with open(file_path, "r+", encoding="utf-8") as file:
-        tenders = json.load(file)
+    tenders = load_snapshot(file_path)
 
     return tenders["opening_tenders"], tenders["warranties"]
 
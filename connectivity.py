@@ -0,0 +1,154 @@
+"""Waiting for the network the watcher is allowed to run on.
+
+`ConnectivityGate.wait` returns as soon as the network is usable, otherwise it
+tells its notifier once and sleeps with an exponential backoff between the checks.
+The interfaces are scanned at most once per `INTERFACE_TTL` seconds however often
+they are checked.
+
+On a desktop the watcher only runs over Wi-Fi and a message box asks for the
+ethernet cable to be disconnected. A headless daemon (`python sleepy_eye.py
+--daemon`) runs over any interface and logs instead.
+"""
+import ctypes
+import sys
+import threading
+import time
+from typing import Callable
+
+import psutil
+
+# Seconds an interface scan is reused for
+INTERFACE_TTL = 5.0
+
+# Bounds of the time between two checks while the network is unusable
+MIN_BACKOFF = 1.0
+MAX_BACKOFF = 5 * 60
+
+
+class InterfaceState:
+    """The interfaces that are up and have a routable address, scanned at most
+    once per `ttl` seconds"""
+
+    def __init__(self, ttl=INTERFACE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._scanned = float("-inf")
+        self._up: list[str] = []
+
+    def up(self) -> list[str]:
+        with self._lock:
+            if time.monotonic() - self._scanned >= self.ttl:
+                self._up = scan_interfaces()
+                self._scanned = time.monotonic()
+            return self._up
+
+    def invalidate(self):
+        with self._lock:
+            self._scanned = float("-inf")
+
+
+def scan_interfaces() -> list[str]:
+    addresses = psutil.net_if_addrs()
+    stats = psutil.net_if_stats()
+    available_networks = []
+
+    for intface, addr_list in addresses.items():
+        if any(getattr(addr, "address").startswith("169.254") for addr in addr_list):
+            continue
+        elif intface in stats and getattr(stats[intface], "isup"):
+            available_networks.append(intface)
+    return available_networks
+
+
+interfaces = InterfaceState()
+
+
+def active_network(state: InterfaceState = interfaces):
+    networklsit = state.up()
+
+    if "Ethernet" in networklsit:
+        return "ethernet"
+    elif "Wi-Fi" in networklsit:
+        return "Wi-Fi"
+
+
+def wifi_only(state: InterfaceState = interfaces) -> bool:
+    return active_network(state) == "Wi-Fi"
+
+
+def any_network(state: InterfaceState = interfaces) -> bool:
+    """Whether an interface other than the loopback one is up"""
+    return any(
+        not (name == "lo" or name.lower().startswith("loopback")) for name in state.up()
+    )
+
+
+def Mbox(title, text, style):
+    result = ctypes.windll.user32.MessageBoxW(0, text, title, style)  # type: ignore
+    if result == 2:  # 1 corresponds to  "OK" 2 to "Canceled"
+        exit()
+
+
+def message_box_notifier(waiting: bool):
+    if waiting:
+        Mbox(
+            "Ethernet cable is connected",
+            "Disconnect the ethernet cable to run",
+            0,
+        )
+
+
+def log_notifier(waiting: bool):
+    if waiting:
+        print("Waiting for the network ...")
+    else:
+        print("Network is back")
+
+
+class ConnectivityGate:
+    """Blocks until `check()` passes.
+
+    `notifier(True)` is called once when the gate starts waiting and
+    `notifier(False)` once it opens again, the checks in between are spaced from
+    `min_backoff` up to `max_backoff` seconds.
+    """
+
+    def __init__(
+        self,
+        check: Callable[[], bool] = wifi_only,
+        notifier: Callable[[bool], None] = message_box_notifier,
+        min_backoff=MIN_BACKOFF,
+        max_backoff=MAX_BACKOFF,
+        state: InterfaceState = interfaces,
+    ):
+        self.check = check
+        self.notifier = notifier
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.state = state
+
+    def wait(self):
+        if self.check():
+            return
+
+        self.notifier(True)
+        delay = self.min_backoff
+        while True:
+            time.sleep(delay)
+            # a fresh scan, the cached one is what failed the last check
+            self.state.invalidate()
+            if self.check():
+                break
+            delay = min(self.max_backoff, delay * 2)
+        self.notifier(False)
+
+
+def desktop_gate() -> ConnectivityGate:
+    """Only Wi-Fi, asking for the ethernet cable to be disconnected on Windows"""
+    notifier = message_box_notifier if sys.platform == "win32" else log_notifier
+    return ConnectivityGate(wifi_only, notifier)
+
+
+def daemon_gate() -> ConnectivityGate:
+    """Any interface, logging the outages"""
+    return ConnectivityGate(any_network, log_notifier)
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+import time
+from typing import Any, Callable
+
+# Seconds between two looks at a file `CachedFile.wait` is waiting on
+POLL_INTERVAL = 5.0
+
+
+def load_json(path: str) -> Any:
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CachedFile:
+    """The content of `path` as returned by `load(path)`, loaded again only once the
+    modification time or the size of `path` (or of one of its `companions`, e.g. a
+    SQLite `-wal` file) changed. With `digest` set the content is hashed as well so
+    a file touched without being changed isn't loaded again.
+
+    `changed` tells whether the last `get` loaded the file.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        load: Callable[[str], Any] = load_json,
+        digest=True,
+        companions: tuple[str, ...] = (),
+    ):
+        self.path = path
+        self.load = load
+        self.digest = digest
+        self.companions = companions
+        self.changed = False
+        self._signature = None
+        self._digest = None
+        self._value = None
+
+    def signature(self) -> tuple:
+        res = []
+        for path in (self.path, *self.companions):
+            try:
+                stat = os.stat(path)
+                res.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                res.append(None)
+        return tuple(res)
+
+    def get(self) -> Any:
+        signature = self.signature()
+        self.changed = False
+        if signature == self._signature:
+            return self._value
+
+        digest = file_digest(self.path) if self.digest else None
+        if digest is None or digest != self._digest:
+            self._value = self.load(self.path)
+            self.changed = True
+        self._signature, self._digest = signature, digest
+        return self._value
+
+    def refresh(self):
+        """Take the current state of `path` as the one of the value in memory, after
+        the value was written to `path`"""
+        self._signature = self.signature()
+        self._digest = file_digest(self.path) if self.digest else None
+
+    def wait(self, timeout: float, poll=POLL_INTERVAL) -> bool:
+        """Sleep until `path` is modified or `timeout` seconds have passed, returns
+        whether it was modified"""
+        deadline = time.monotonic() + timeout
+        while (left := deadline - time.monotonic()) > 0:
+            time.sleep(min(poll, left))
+            if self.signature() != self._signature:
+                return True
+        return False
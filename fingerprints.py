@@ -0,0 +1,111 @@
+"""Per tender content fingerprints kept next to a snapshot.
+
+    {"<section>": {"<ministry_code>": {"<tender_id>": {"record": ..., "page": ...}}}}
+
+`record` hashes the tender with its keys sorted, and `page` the page it was parsed
+from along with the bidding type popups the page links to. A watched tender whose
+page hash didn't change is known to be unchanged without parsing the page.
+
+    python fingerprints.py [snapshot]           prints the fingerprints
+    python fingerprints.py rebuild [snapshot]   recomputes them from the snapshot
+"""
+import hashlib
+import json
+import os
+import threading
+from typing import Any
+
+from constants import TENDERS_FILE
+from snapshot import SECTIONS, RawJSON, load_snapshot, peek
+
+
+def fingerprint_file(snapshot_file: str) -> str:
+    return f"{snapshot_file}.fingerprints.json"
+
+
+def record_digest(tender: Any) -> str:
+    """Hash `tender` serialized with its keys sorted, so that the order the fields
+    were parsed or stored in doesn't matter"""
+    if isinstance(tender, RawJSON):
+        tender = json.loads(tender)
+    return hashlib.sha256(
+        json.dumps(tender, ensure_ascii=False, sort_keys=True).encode()
+    ).hexdigest()
+
+
+def page_digest(page: bytes, *popups: bytes) -> str:
+    """Hash `page` and the bodies of the `popups` it links to"""
+    digest = hashlib.sha256(page)
+    for popup in popups:
+        digest.update(hashlib.sha256(popup).digest())
+    return digest.hexdigest()
+
+
+class Fingerprints:
+    """The fingerprints of the tenders of `snapshot_file`, safe to update from
+    several threads"""
+
+    def __init__(self, snapshot_file=TENDERS_FILE, load=True):
+        self.file = fingerprint_file(snapshot_file)
+        self._lock = threading.Lock()
+        self.tenders: dict[str, dict[str, dict[str, dict[str, str]]]] = {}
+        if load and os.path.exists(self.file):
+            with open(self.file, "r", encoding="utf-8") as source:
+                self.tenders = json.load(source)
+
+    def get(self, section: str, code: str, id: str) -> dict[str, str]:
+        with self._lock:
+            return dict(self.tenders.get(section, {}).get(code, {}).get(id, {}))
+
+    def set(self, section: str, code: str, id: str, **digests: str):
+        """Replace the `record` and/or `page` digests of a tender"""
+        with self._lock:
+            self.tenders.setdefault(section, {}).setdefault(code, {})[id] = digests
+
+    def save(self):
+        with self._lock:
+            content = json.dumps(self.tenders, ensure_ascii=False)
+        with open(f"{self.file}.partial", "w+", encoding="utf-8") as target:
+            target.write(content)
+        os.replace(f"{self.file}.partial", self.file)
+
+
+def rebuild(snapshot_file=TENDERS_FILE) -> Fingerprints:
+    """Recompute the record digests of `snapshot_file`, the page digests of the
+    tenders whose record didn't change are kept"""
+    previous = Fingerprints(snapshot_file)
+    fingerprints = Fingerprints(snapshot_file, load=False)
+
+    omni = load_snapshot(snapshot_file)
+    for section in SECTIONS:
+        for code, ministry in omni.get(section, {}).items():
+            for id in (tenders := ministry["tenders"]):
+                update(fingerprints, previous, section, code, id, peek(tenders, id))
+    return fingerprints
+
+
+def update(
+    fingerprints: Fingerprints,
+    previous: Fingerprints,
+    section: str,
+    code: str,
+    id: str,
+    tender: Any,
+):
+    """Set the record digest of `tender` in `fingerprints`, keeping the page digest
+    from `previous` when the record is the same"""
+    digests = {"record": record_digest(tender)}
+    old = previous.get(section, code, id)
+    if old.get("record") == digests["record"] and "page" in old:
+        digests["page"] = old["page"]
+    fingerprints.set(section, code, id, **digests)
+
+
+if __name__ == "__main__":
+    import sys
+
+    args = sys.argv[1:]
+    if args and args[0] == "rebuild":
+        rebuild(*args[1:2]).save()
+    else:
+        print(json.dumps(Fingerprints(*args[:1]).tenders, ensure_ascii=False, indent=2))
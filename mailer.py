@@ -0,0 +1,281 @@
+import itertools
+import json
+import os
+import queue
+import smtplib
+import socket
+import ssl
+import threading
+import time
+from email.message import Message
+
+import metrics
+
+# Attempts to send a message, reconnecting in between when the connection dropped
+MAIL_RETRIES = 3
+MAIL_BACKOFF = 2.0
+
+# Pending notifications, one `<id>.json` file per message
+QUEUE_DIR = "env/mail_queue"
+
+# Messages sent at once by the queue, each worker holds its own connection
+MAIL_WORKERS = 1
+
+# Attempts at a queued message before it is moved to `<QUEUE_DIR>/failed`, the
+# first retry waits `QUEUE_BACKOFF` seconds and every other one twice as long
+QUEUE_ATTEMPTS = 8
+QUEUE_BACKOFF = 60.0
+
+# A worker idle for that long closes its connection
+IDLE_TIMEOUT = 30.0
+
+# The errors of a dropped or unreachable connection, the other `SMTPException`s
+# (authentication, refused recipients, rejected data) aren't retried by a session
+RECONNECT_ERRORS = (
+    smtplib.SMTPServerDisconnected,
+    smtplib.SMTPConnectError,
+    ConnectionError,
+    socket.timeout,
+)
+
+
+class MailSession:
+    """One authenticated SMTP connection reused for all the messages of a polling
+    cycle, opened on the first message and reopened when the server drops it.
+
+        with MailSession(mail_config) as session:
+            session.send(message)
+    """
+
+    def __init__(self, mail_config, retries=MAIL_RETRIES, backoff=MAIL_BACKOFF):
+        self.mail_config = mail_config
+        self.retries = retries
+        self.backoff = backoff
+        self._context = None
+        self._server = None
+
+    @property
+    def sender_email(self) -> str:
+        return self.mail_config["sender_email"][0]["email"]
+
+    @property
+    def recievers(self) -> list[str]:
+        return self.mail_config["notify_list"]
+
+    def connect(self) -> smtplib.SMTP:
+        if self._server is not None:
+            return self._server
+
+        if self._context is None:
+            self._context = ssl.create_default_context()
+        server = smtplib.SMTP(
+            self.mail_config["smtp_server"], self.mail_config["smtp_port"]
+        )
+        try:
+            server.ehlo()
+            server.starttls(context=self._context)
+            server.ehlo()
+            server.login(
+                self.sender_email, self.mail_config["sender_email"][0]["password"]
+            )
+        except BaseException:
+            server.close()
+            raise
+        self._server = server
+        return server
+
+    def send(self, message: Message | str):
+        """Send `message` to the `notify_list`, retrying on a dropped connection"""
+        if isinstance(message, Message):
+            message = message.as_string()
+        for retry in range(self.retries):
+            try:
+                self.connect().sendmail(self.sender_email, self.recievers, message)
+                return
+            except RECONNECT_ERRORS as e:
+                self.close()
+                if retry == self.retries - 1:
+                    raise
+                print(f"RETRYING MAIL after: {e}")
+                time.sleep(self.backoff * 2**retry)
+
+    def close(self):
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except (smtplib.SMTPException, OSError):
+            self._server.close()
+        self._server = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class MailQueue:
+    """Notifications handed over to `workers` background threads, so that a slow
+    SMTP server doesn't hold the caller.
+
+    Every message is written to `directory` before `put` returns and removed once
+    sent, the messages left by a previous run are queued again by `start`. A
+    message that fails is retried with an exponential backoff, up to `attempts`
+    times.
+
+        mail_queue = MailQueue(mail_config).start()
+        mail_queue.put(message)
+    """
+
+    def __init__(
+        self,
+        mail_config,
+        directory=QUEUE_DIR,
+        workers=MAIL_WORKERS,
+        attempts=QUEUE_ATTEMPTS,
+        backoff=QUEUE_BACKOFF,
+    ):
+        self.mail_config = mail_config
+        self.directory = directory
+        self.workers = max(1, workers)
+        self.attempts = attempts
+        self.backoff = backoff
+        self._queue: queue.Queue[str] = queue.Queue()
+        self._seq = itertools.count()
+        self._threads: list[threading.Thread] = []
+        os.makedirs(os.path.join(directory, "failed"), exist_ok=True)
+
+    def _path(self, id: str) -> str:
+        return os.path.join(self.directory, f"{id}.json")
+
+    def _write(self, id: str, job: dict):
+        path = self._path(id)
+        with open(f"{path}.partial", "w+", encoding="utf-8") as target:
+            json.dump(job, target, ensure_ascii=False)
+        os.replace(f"{path}.partial", path)
+
+    def pending(self) -> list[str]:
+        """The ids of the messages waiting in `directory`, oldest first"""
+        return sorted(
+            file[: -len(".json")]
+            for file in os.listdir(self.directory)
+            if file.endswith(".json")
+        )
+
+    def put(self, message: Message | str) -> str:
+        """Store `message` and queue it, returns its id"""
+        if isinstance(message, Message):
+            message = message.as_string()
+        id = f"{time.time_ns():020d}-{next(self._seq):06d}"
+        self._write(id, {"message": message, "attempts": 0, "not_before": 0.0})
+        if self._threads:  # otherwise `start` picks it up from `directory`
+            self._queue.put(id)
+        return id
+
+    def start(self):
+        """Queue the messages left in `directory` and start the workers"""
+        for id in self.pending():
+            self._schedule(id)
+        for _ in range(self.workers - len(self._threads)):
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def join(self):
+        """Wait until every queued message was sent or given up on"""
+        self._queue.join()
+
+    def _read(self, id: str) -> dict | None:
+        """The job `id`, or `None` once it is gone. A job that can't be read, e.g. a
+        file truncated by a crash, is moved to `<directory>/failed`."""
+        path = self._path(id)
+        try:
+            with open(path, "r", encoding="utf-8") as source:
+                job = json.load(source)
+            job["message"], job["attempts"], job["not_before"]  # the fields of a job
+            return job
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"ERROR: {e!r}, giving up on the unreadable notification {id}")
+            try:
+                os.replace(path, os.path.join(self.directory, "failed", f"{id}.json"))
+            except OSError:
+                pass
+            return None
+
+    def _schedule(self, id: str):
+        if (job := self._read(id)) is None:
+            return
+        delay = job["not_before"] - time.time()
+        if delay <= 0:
+            self._queue.put(id)
+            return
+        timer = threading.Timer(delay, self._queue.put, (id,))
+        timer.daemon = True
+        timer.start()
+
+    def _work(self):
+        session = None
+        while True:
+            try:
+                id = self._queue.get(timeout=IDLE_TIMEOUT)
+            except queue.Empty:
+                if session is not None:
+                    session.close()
+                    session = None
+                continue
+
+            try:
+                if session is None or session.mail_config is not self.mail_config:
+                    if session is not None:
+                        session.close()
+                    session = MailSession(self.mail_config)
+                self._send(session, id)
+            except Exception as e:
+                # e.g. a full disk, the message stays in `directory` and is queued
+                # again later so the worker keeps going
+                print(f"ERROR: {e}, queuing the notification {id} again later")
+                if session is not None:
+                    session.close()
+                    session = None
+                timer = threading.Timer(self.backoff, self._queue.put, (id,))
+                timer.daemon = True
+                timer.start()
+            finally:
+                self._queue.task_done()
+
+    def _send(self, session: MailSession, id: str):
+        path = self._path(id)
+        if (job := self._read(id)) is None:
+            return
+
+        start = time.perf_counter()
+        try:
+            session.send(job["message"])
+        except Exception as e:
+            session.close()
+            metrics.observe(
+                "notify_seconds", time.perf_counter() - start, outcome="failed"
+            )
+            job["attempts"] += 1
+            if job["attempts"] >= self.attempts:
+                print(f"ERROR: {e}, giving up on the notification {id}")
+                os.replace(path, os.path.join(self.directory, "failed", f"{id}.json"))
+                return
+            delay = self.backoff * 2 ** (job["attempts"] - 1)
+            print(f"ERROR: {e}, retrying the notification {id} in {delay:.0f} s")
+            job["not_before"] = time.time() + delay
+            self._write(id, job)
+            self._schedule(id)
+            return
+
+        metrics.observe("notify_seconds", time.perf_counter() - start, outcome="sent")
+        # the id starts with the time the message was queued at
+        metrics.observe("notify_delay_seconds", (time.time_ns() - int(id[:20])) / 1e9)
+        os.remove(path)
+        print(
+            f"An email notification had been sent to [{', '.join(session.recievers)}]"
+        )
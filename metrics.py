@@ -0,0 +1,190 @@
+"""Counters and histograms of the crawler and the watcher.
+
+The metrics are kept in the process wide `registry` and labelled with the
+`section` and `ministry` of the work being done in the current thread (see
+`labels`), e.g. an `http_request_seconds` observation made while fetching a tender
+is counted under the section and the ministry of the tender.
+
+    with metrics.labels(section="warranties", ministry="10"):
+        with metrics.timer("parse_seconds"):
+            ...
+    metrics.export("watch")
+
+`export` writes the Prometheus text format to `<METRICS_DIR>/<name>.prom`, for the
+textfile collector of the node exporter, along a JSON summary in
+`<METRICS_DIR>/<name>.json`. The values add up over the life of the process.
+"""
+import bisect
+import contextlib
+import json
+import os
+import threading
+import time
+from typing import Iterator
+
+METRICS_DIR = "env/metrics"
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+Labels = tuple[tuple[str, str], ...]
+
+_context = threading.local()
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.max = 0.0
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """The upper bound of the bucket holding the `q` quantile"""
+        rank, seen = q * self.count, 0
+        for bound, count in zip((*self.buckets, self.max), self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Registry:
+    """The counters and the histograms by name and labels, safe to update from
+    several threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: dict[str, dict[Labels, float]] = {}
+        self.histograms: dict[str, dict[Labels, Histogram]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels: str):
+        key = label_key(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: str):
+        key = label_key(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    def prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{format_labels(key)} {value:g}")
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(
+                        (*histogram.buckets, "+Inf"), histogram.counts
+                    ):
+                        cumulative += count
+                        le = format_labels(key + (("le", f"{bound}"),))
+                        lines.append(f"{name}_bucket{le} {cumulative}")
+                    lines.append(f"{name}_sum{format_labels(key)} {histogram.sum:g}")
+                    lines.append(f"{name}_count{format_labels(key)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> dict:
+        """The counters and the `count`, `sum`, `mean`, `p50`, `p95` and `max` of
+        the histograms, by name and labels"""
+        with self._lock:
+            return {
+                "counters": {
+                    name: [{**dict(key), "value": v} for key, v in series.items()]
+                    for name, series in sorted(self.counters.items())
+                },
+                "histograms": {
+                    name: [
+                        {
+                            **dict(key),
+                            "count": h.count,
+                            "sum": round(h.sum, 6),
+                            "mean": round(h.sum / max(1, h.count), 6),
+                            "p50": h.quantile(0.5),
+                            "p95": h.quantile(0.95),
+                            "max": round(h.max, 6),
+                        }
+                        for key, h in series.items()
+                    ]
+                    for name, series in sorted(self.histograms.items())
+                },
+            }
+
+
+registry = Registry()
+
+
+def label_key(labels: dict[str, str]) -> Labels:
+    """`labels` on top of the ones of the current `labels` context"""
+    merged = {**getattr(_context, "labels", {}), **labels}
+    return tuple(sorted((k, str(v)) for k, v in merged.items() if v is not None))
+
+
+def format_labels(key: Labels) -> str:
+    if not key:
+        return ""
+    escaped = (
+        (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in key
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+@contextlib.contextmanager
+def labels(**labels: str | None) -> Iterator[None]:
+    """Label the metrics recorded by the current thread within the block"""
+    previous = getattr(_context, "labels", {})
+    _context.labels = {**previous, **labels}
+    try:
+        yield
+    finally:
+        _context.labels = previous
+
+
+def inc(name: str, value: float = 1, **labels: str):
+    registry.inc(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels: str):
+    registry.observe(name, value, **labels)
+
+
+@contextlib.contextmanager
+def timer(name: str, **labels: str) -> Iterator[None]:
+    """Observe the duration of the block in the `name` histogram"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(name, time.perf_counter() - start, **labels)
+
+
+def export(name: str, directory=METRICS_DIR):
+    """Write `<name>.prom` and `<name>.json` in `directory`"""
+    os.makedirs(directory, exist_ok=True)
+    for ext, content in (
+        ("prom", registry.prometheus()),
+        ("json", json.dumps(registry.summary(), ensure_ascii=False, indent=2)),
+    ):
+        path = os.path.join(directory, f"{name}.{ext}")
+        with open(f"{path}.partial", "w+", encoding="utf-8") as target:
+            target.write(content)
+        os.replace(f"{path}.partial", path)
@@ -1,177 +1,96 @@
-import json
+import sqlite3
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pprint
 from typing import Any
 from datetime import datetime ,timedelta
-import psutil
-import ctypes
-
-from urllib3 import PoolManager
 
+from connectivity import ConnectivityGate, daemon_gate, desktop_gate
+import metrics
+from mailer import MAIL_WORKERS, MailQueue, MailSession
 from constants import CONFIG_FILE, TENDERS_FILE, WATCH_LIST
-from snif_mice import Tender, get_opening_tender, get_warranty
+from file_cache import CachedFile
+from snapshot import load_snapshot, save_tenders
+from watch_schedule import MAX_INTERVAL, PollScheduler
+from fingerprints import Fingerprints, page_digest, record_digest
+from snif_mice import (
+    Tender,
+    fetch_opening_tender,
+    fetch_popups,
+    popup_memo,
+    fetch_warranty,
+    opening_tender_from_response,
+    warranty_from_response,
+)
 from str_metric.html_template import GLOBAL_STYLE
-from str_metric.levenshtein import html_output
-
-http = PoolManager()
+from tender_diff import Change, diff, render_html, render_text
 
 LOG_FILE = "watch.log"
-def active_network():
-    addresses = psutil.net_if_addrs()
-    stats = psutil.net_if_stats()
-    available_networks = []
 
-    for intface, addr_list in addresses.items():
-        if any(getattr(addr, "address").startswith("169.254") for addr in addr_list):
-            continue
-        elif intface in stats and getattr(stats[intface], "isup"):
-            available_networks.append(intface)
-
-    networklsit = available_networks
-
-    if "Ethernet" in networklsit:
-        return "ethernet"
-    elif "Wi-Fi" in networklsit:
-        return "Wi-Fi"
-    
-def Mbox(title, text, style):
-    result = ctypes.windll.user32.MessageBoxW(0, text, title, style)
-    if result == 2:  # 1 corresponds to  "OK" 2 to "Canceled"
-        exit()
-    
-def basic_str(obj):
-    if isinstance(obj, str):
-        return obj
-    if isinstance(obj, int):
-        return f"{obj:,}"
-    if isinstance(obj, float):
-        return f"{obj:,.3f}"
-    assert False, f"`basic_str` only works on ints, floats, and strings, found type {type(obj)}, {obj = }"
-
-
-def display_obj(obj: list | dict[str, Any] | str | int | float) -> str:
-    """Turn into html"""
-    if type(obj) in (str, int, float):
-        return basic_str(obj)
-    if isinstance(obj, list):
-        res = "<ul>"
-        for elem in obj:
-            res += f"<li>{display_obj(elem)}</li>"
-        return res + "</ul>"
-    res = "<dl>"
-    for k, v in obj.items():  # type: ignore
-        res += f"<dt>{display_obj(k)}</dt><dd>{display_obj(v)}</dd>"
-    return res + "</dl>"
-
-
-def remove_obj(obj):
-    if type(obj) in (str, int, float):
-        return f'<span class="_removed">{obj}</span>'
-    elif isinstance(obj, list):
-        return list(map(lambda e: remove_obj(e), obj))
-    elif isinstance(obj, dict):
-        return {remove_obj(k): remove_obj(v) for k, v in obj.items()}
-    assert False, f"don't know how to remove object of type {type(obj)}: {obj}"
-
-
-def add_obj(obj):
-    if type(obj) in (str, int, float):
-        return f'<span class="_added">{obj}</span>'
-    elif isinstance(obj, list):
-        return list(map(lambda e: add_obj(e), obj))
-    elif isinstance(obj, dict):
-        return {add_obj(k): add_obj(v) for k, v in obj.items()}
-    assert False, f"don't know how to add object of type {type(obj)}: {obj}"
-
-
-def list_difference(old_list, new_list):
-    _old_list = []
-    _new_list = []
-
-    for e in old_list:
-        if e not in new_list:
-            _old_list.append(remove_obj(e))
-        else:
-            _old_list.append(e)
+# Watched tenders fetched at once, the requests still go through the shared
+# `capt_http` scheduler and its rate limit
+WATCH_WORKERS = 8
 
-    for e in new_list:
-        if e not in old_list:
-            _new_list.append(add_obj(e))
-        else:
-            _new_list.append(e)
 
-    return _old_list, _new_list
+def mail_subject(old_tender: Tender, tender_id: str) -> str:
+    tender_subject = old_tender["Tender Subject"]
+    if len(tender_subject) > 120:
+        tender_subject = tender_subject[:116] + " ..."
+    else:
+        tender_subject = tender_subject[:120]
+    return f"{tender_id} - {tender_subject}".replace("\n", " ")
 
 
-def dict_difference(old_tender, new_tender):
-    if isinstance(new_tender, str):
-        return remove_obj(old_tender), new_tender
+def change_html(
+    change: Change, ministry_name: str, tender_id: str, internal_id: str
+) -> str:
+    """The html section describing the `change` of a single tender, only the fields
+    that changed are shown"""
+    _old_tender_display = render_html(change, "old")
+    _new_tender_display = render_html(change, "new")
 
-    _old_tender = {}
-    _new_tender = {}
+    return f"""\
+<h2>{ministry_name} :: {tender_id}</h2>
 
-    for k in old_tender:
-        if k not in new_tender:
-            _old_tender[remove_obj(k)] = remove_obj(old_tender[k])
-        elif isinstance(old_tender[k], list):
-            old_list, new_list = list_difference(old_tender[k], new_tender[k])
-            _old_tender[k] = old_list
-            _new_tender[k] = new_list
-        elif isinstance(old_tender[k], dict):
-            _old_highlighted, _new_highlighted = dict_difference(
-                old_tender[k], new_tender[k]
-            )
-            _old_tender[k] = _old_highlighted
-            _new_tender[k] = _new_highlighted
-        elif type(old_tender[k]) in (str, int, float):
-            old = basic_str(old_tender[k])
-            new = basic_str(new_tender[k])
-            _old_highlighted, _new_highlighted = html_output(old, new)
-            _old_tender[k] = _old_highlighted
-            _new_tender[k] = _new_highlighted
+<p>The Tender/Warranty of "{internal_id}" had changed</p>
 
-    for k in new_tender:
-        if k not in old_tender:
-            _new_tender[add_obj(k)] = add_obj(new_tender[k])
-    return _old_tender, _new_tender
+<h2>From</h2>
+<dl> <dt>{tender_id}</dt> <dd>{_old_tender_display}</dd> </dl>
 
+<h2>To</h2>
+<dl> <dt>{tender_id}</dt> <dd>{_new_tender_display}</dd> </dl>
+"""
 
-def notify_by_mail(
-    old_tender: Tender,
-    new_tender: Tender | str,
-    ministry_name: str,
-    tender_id: str,
-    internal_id: str,
-    mail_config,
-):
-    import smtplib
-    import ssl
-    from email.mime.multipart import MIMEMultipart
-    from email.mime.text import MIMEText
 
-    sender_emails = mail_config["sender_email"]
-    sender_email = sender_emails[0]["email"]
-    sender_email = sender_emails[0]["email"]
-    app_password = sender_emails[0]["password"]
-    recievers = mail_config["notify_list"]
+def change_text(
+    change: Change, ministry_name: str, tender_id: str, internal_id: str
+) -> str:
+    """The plain text counterpart of `change_html`"""
+    return (
+        f"{ministry_name} :: {tender_id}\n"
+        f'The Tender/Warranty of "{internal_id}" had changed\n\n'
+        f"{render_text(change)}\n"
+    )
 
-    tender_subject = old_tender["Tender Subject"]
-    if len(tender_subject) > 120:
-        tender_subject = tender_subject[:116] + " ..."
-    else:
-        tender_subject = tender_subject[:120]
-    tender_subject.replace("\n", " ")
 
-    message = MIMEMultipart("alternative")
-    message["Subject"] = f"{tender_id} - {tender_subject}"
-    message["From"] = sender_email
-    message["To"] = ", ".join(recievers)
+def mail_message(subject: str, changes: list[tuple], mail_config):
+    """A message describing the `changes`, each holding the old and the new tender,
+    the ministry name, the tender id and the internal id, with a plain text and a
+    html part rendered from the same change trees"""
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
 
-    _old_tender, _new_tender = dict_difference(old_tender, new_tender)
+    message = MIMEMultipart("alternative")
+    message["Subject"] = subject
+    message["From"] = mail_config["sender_email"][0]["email"]
+    message["To"] = ", ".join(mail_config["notify_list"])
 
-    _old_tender_display = display_obj(_old_tender)
-    _new_tender_display = display_obj(_new_tender)
+    sections = []
+    for old_tender, new_tender, *names in changes:
+        with metrics.timer("diff_seconds"):
+            sections.append((diff(old_tender, new_tender), *names))
 
+    body = "\n<hr>\n\n".join(change_html(*section) for section in sections)
     text = f"""\
 <!DOCTYPE html>
 <html>
@@ -180,40 +99,68 @@ def notify_by_mail(
     <style> {GLOBAL_STYLE} </style>
 </head>
 <body>
-<h2>{ministry_name} :: {tender_id}</h2>
-
-<p>The Tender/Warranty of "{internal_id}" had changed</p>
-
-<h2>From</h2>
-<dl> <dt>{tender_id}</dt> <dd>{_old_tender_display}</dd> </dl>
-
-<h2>To</h2>
-<dl> <dt>{tender_id}</dt> <dd>{_new_tender_display}</dd> </dl>
-
+{body}
 </body>
 </html>
 """
 
-    body_text = MIMEText(text, "html")
-    message.attach(body_text)
+    message.attach(MIMEText("\n\n".join(change_text(*c) for c in sections), "plain"))
+    message.attach(MIMEText(text, "html"))
+    return message
+
 
+def send_mail(message, mail_config, session: MailSession | None = None):
+    """Send `message` through `session`, or through a connection of its own"""
+    recievers = mail_config["notify_list"]
+    start = time.perf_counter()
     try:
-        if ctx := ssl.create_default_context():
-            server = smtplib.SMTP(mail_config["smtp_server"], mail_config["smtp_port"])
-            server.ehlo()
-            server.starttls(context=ctx)
-            server.ehlo()
-            server.login(sender_email, app_password)
-            server.sendmail(sender_email, recievers, message.as_string())
+        if session is not None:
+            session.send(message)
         else:
-            print("FAILED TO ESTABLISH SSL CONTEXT")
+            with MailSession(mail_config) as session:
+                session.send(message)
     except Exception as e:
+        metrics.observe("notify_seconds", time.perf_counter() - start, outcome="failed")
         print(f"ERROR: {e}")
-    finally:
-        server.quit()  # type: ignore
+    else:
+        metrics.observe("notify_seconds", time.perf_counter() - start, outcome="sent")
         print(f"An email notification had been sent to [{', '.join(recievers)}]")
 
 
+def digest_message(changes: list[tuple], mail_config):
+    """A single message for all the `changes`, each change holds the arguments of
+    `notify_by_mail` up to `mail_config`"""
+    if len(changes) == 1:
+        subject = mail_subject(changes[0][0], changes[0][3])
+    else:
+        subject = f"{len(changes)} tenders changed - " + ", ".join(
+            tender_id for _, _, _, tender_id, _ in changes
+        )
+        if len(subject) > 120:
+            subject = subject[:116] + " ..."
+    return mail_message(subject, changes, mail_config)
+
+
+def notify_by_mail(
+    old_tender: Tender,
+    new_tender: Tender | str,
+    ministry_name: str,
+    tender_id: str,
+    internal_id: str,
+    mail_config,
+    session: MailSession | None = None,
+):
+    message = digest_message(
+        [(old_tender, new_tender, ministry_name, tender_id, internal_id)], mail_config
+    )
+    send_mail(message, mail_config, session)
+
+
+def notify_digest(changes: list[tuple], mail_config, session=None):
+    """Send a single message for all the `changes` of a cycle"""
+    send_mail(digest_message(changes, mail_config), mail_config, session)
+
+
 def log_change(old, new):
     print("OLD:")
     pprint(old)
@@ -222,23 +169,131 @@ def log_change(old, new):
     pprint(new)
 
 
-def run_server():
+def watched_tenders(tenders, target_list) -> list[tuple[str, str, str]]:
+    """The `(section, ministry_code, tender_id)` of the watched tenders that are in the
+    snapshot, in the order `run_server` goes through them"""
+    return [
+        (section, ministry_code, tender_id)
+        for section in ("opening_tenders", "warranties")
+        for ministry_code in target_list.get(section) or {}
+        if (ministry := tenders[section].get(ministry_code))
+        for tender_id in target_list[section][ministry_code]
+        if ministry["tenders"].get(tender_id)
+    ]
+
+
+def check_watched(unit, old_tender, fingerprints: Fingerprints) -> tuple[Any, bool]:
+    """Fetch the current version of the watched `(section, ministry_code, tender_id)`,
+    a page matching its fingerprint isn't parsed and the `old_tender` is returned as
+    is, as long as `old_tender` is the record the fingerprint was taken of.
+    Otherwise the fingerprints are updated and the digest of the new record is
+    compared to the one of `old_tender`.
+
+    Returns:
+        tuple[Any, bool]: The current version of the tender and whether it changed
+    """
+    section, ministry_code, tender_id = unit
+    with metrics.labels(section=section, ministry=ministry_code):
+        tender, outcome = _check_watched(unit, old_tender, fingerprints)
+        metrics.inc("watch_checks_total", outcome=outcome)
+    return tender, outcome == "changed"
+
+
+def _check_watched(unit, old_tender, fingerprints: Fingerprints) -> tuple[Any, str]:
+    section, ministry_code, tender_id = unit
+    fetch, parse = {
+        "opening_tenders": (fetch_opening_tender, opening_tender_from_response),
+        "warranties": (fetch_warranty, warranty_from_response),
+    }[section]
+
+    page = fetch(ministry_code, tender_id)
+    known = fingerprints.get(*unit)
+    old_record = record_digest(old_tender)
+    # a change confined to a bidding type popup changes the digest too, the popups
+    # are fetched once and parsed from the same bodies
+    popups = fetch_popups(page.data)
+    digest = page_digest(page.data, *popups.values())
+    if known.get("page") == digest and known.get("record") == old_record:
+        return old_tender, "same_page"
+
+    if section == "opening_tenders":
+        new_tender = parse(page, popup_memo(popups))
+    else:
+        new_tender = parse(page)
+    record = record_digest(new_tender)
+    fingerprints.set(*unit, record=record, page=digest)
+    return new_tender, "changed" if record != old_record else "unchanged"
+
+
+def fetch_watched(tenders, units, fingerprints, workers=WATCH_WORKERS) -> dict:
+    """`check_watched` every `(section, ministry_code, tender_id)` of `units` with a
+    pool of `workers` threads"""
+    with ThreadPoolExecutor(max(1, workers)) as pool:
+        return dict(
+            zip(
+                units,
+                pool.map(
+                    lambda unit: check_watched(
+                        unit,
+                        tenders[unit[0]][unit[1]]["tenders"][unit[2]],
+                        fingerprints,
+                    ),
+                    units,
+                ),
+            )
+        )
+
+
+def run_server(gate: ConnectivityGate | None = None):
+    gate = gate or desktop_gate()
+    scheduler = PollScheduler()
+    mail_queue = None
+    # the files are only loaded again once they change on the disk, the tenders
+    # stay in memory between the cycles
+    tenders_file = CachedFile(
+        TENDERS_FILE, load_snapshot, digest=False, companions=(f"{TENDERS_FILE}-wal",)
+    )
+    watch_file = CachedFile(WATCH_LIST)
+    config_file = CachedFile(CONFIG_FILE)
+    # the changed tenders not saved yet, e.g. while a crawl was swapping the store
+    unsaved: set[tuple[str, str, str]] = set()
     while True:
-        with open(TENDERS_FILE, "r+", encoding="utf-8") as file:
-            tenders = json.load(file)
-        with open(WATCH_LIST, "r+", encoding="utf-8") as file:
-            target_list = json.load(file)
-        with open(CONFIG_FILE, "r+", encoding="utf-8") as file:
-            global_config = json.load(file)
+        cycle_start = time.perf_counter()
+        tenders = tenders_file.get()
+        if tenders_file.changed:
+            fingerprints = Fingerprints(TENDERS_FILE)
+            # the tenders on the disk replaced the ones in memory
+            unsaved.clear()
+        target_list = watch_file.get()
+        global_config = config_file.get()
 
         mail_config = global_config["mail_config"]
-        change = False
-
-        if opening_tenders := target_list.get("opening_tenders"):
-            opening_tenders = opening_tenders
-        else:
+        # the notifications are sent in the background by `mail_queue`, with
+        # `"digest": true` the changes are collected and sent as a single message
+        if mail_queue is None:
+            mail_queue = MailQueue(
+                mail_config, workers=global_config.get("mail_workers", MAIL_WORKERS)
+            ).start()
+        mail_queue.mail_config = mail_config
+        digest = [] if mail_config.get("digest") else None
+
+        watched = watched_tenders(tenders, target_list)
+        if not watched:
+            print(f"Nothing to watch, waiting for {WATCH_LIST} to change")
+            watch_file.wait(MAX_INTERVAL)
             continue
 
+        scheduler.budget = global_config.get("request_budget")
+        scheduler.sync(watched)
+        due = scheduler.pop_due()
+
+        fetched = fetch_watched(
+            tenders,
+            due,
+            fingerprints,
+            global_config.get("watch_workers", WATCH_WORKERS),
+        )
+
         if opening_tenders := target_list.get("opening_tenders"):
             for ministry_code in opening_tenders:
                 if opening_ministry := tenders["opening_tenders"].get(ministry_code):
@@ -251,9 +306,12 @@ def run_server():
                         old_tender = old_tender
                     else:
                         continue
-                    new_tender = get_opening_tender(ministry_code, tender_id)
-                    if new_tender != old_tender:
-                        change = True
+                    if ("opening_tenders", ministry_code, tender_id) not in fetched:
+                        continue
+                    new_tender, changed = fetched[
+                        ("opening_tenders", ministry_code, tender_id)
+                    ]
+                    if changed:
                         if internal_id := opening_tenders[ministry_code][tender_id]:
                             internal_id = ", ".join(
                                 internal_id
@@ -274,7 +332,7 @@ def run_server():
 
                             new_tender = f"The tender {ministry_name}::{tender_id} no longer exists as of {datetime.now()}"
 
-                        notify_by_mail(
+                        notification = (
                             old_tender,
                             new_tender[0]
                             if isinstance(new_tender, list)
@@ -282,8 +340,15 @@ def run_server():
                             ministry_name,
                             tender_id,
                             internal_id,
-                            mail_config,
                         )
+                        if digest is not None:
+                            digest.append(notification)
+                        else:
+                            with metrics.labels(
+                                section="opening_tenders", ministry=ministry_code
+                            ):
+                                message = digest_message([notification], mail_config)
+                            mail_queue.put(message)
                         tenders["opening_tenders"][ministry_code]["tenders"][
                             tender_id
                         ] = new_tender
@@ -293,10 +358,17 @@ def run_server():
             for ministry_code in warranties:
                 if warranty_ministry := tenders["warranties"].get(ministry_code):
                     for tender_id in warranties[ministry_code]:
-                        if old_tender := warranty_ministry["tenders"].get(tender_id):
-                            new_tender = get_warranty(ministry_code, tender_id)
-                            if new_tender != old_tender:
-                                change = True
+                        if (
+                            "warranties",
+                            ministry_code,
+                            tender_id,
+                        ) not in fetched:
+                            continue
+                        elif old_tender := warranty_ministry["tenders"].get(tender_id):
+                            new_tender, changed = fetched[
+                                ("warranties", ministry_code, tender_id)
+                            ]
+                            if changed:
                                 if internal_id := warranties[ministry_code][tender_id]:
                                     internal_id = ", ".join(
                                         internal_id
@@ -313,14 +385,23 @@ def run_server():
 
                                     new_tender = f"The tender {ministry_name}::{tender_id} no longer exists as of {datetime.now()}"
 
-                                notify_by_mail(
+                                notification = (
                                     old_tender,
                                     new_tender,
                                     ministry_name,
                                     tender_id,
                                     internal_id,
-                                    mail_config,
                                 )
+                                if digest is not None:
+                                    digest.append(notification)
+                                else:
+                                    with metrics.labels(
+                                        section="warranties", ministry=ministry_code
+                                    ):
+                                        message = digest_message(
+                                            [notification], mail_config
+                                        )
+                                    mail_queue.put(message)
                                 tenders["warranties"][ministry_code]["tenders"][
                                     tender_id
                                 ] = new_tender
@@ -331,36 +412,64 @@ def run_server():
         else:
             pass
 
-        if change:
-            with open(TENDERS_FILE, "w+", encoding="utf-8") as file:
-                json.dump(tenders, file, ensure_ascii=False)
+        if digest:
+            mail_queue.put(digest_message(digest, mail_config))
+
+        unsaved.update(unit for unit, (_, changed) in fetched.items() if changed)
+        if unsaved:
+            try:
+                save_tenders(tenders, TENDERS_FILE, sorted(unsaved))
+            except sqlite3.OperationalError as e:
+                print(f"ERROR: {e}, the tenders are saved again next cycle")
+            else:
+                unsaved.clear()
+                tenders_file.refresh()
                 print("Updated the tenders data base")
         else:
             print("Nothing new.")
-        change = False
-        sleep_minutes = 60
-        print(f"Paused     @ {datetime.now().strftime('%H:%M:%S')} for {sleep_minutes} Minutes")
-        next_backup = (datetime.now() + timedelta(minutes = sleep_minutes)).strftime('%H:%M:%S')
+        fingerprints.save()
+        metrics.observe("watch_cycle_seconds", time.perf_counter() - cycle_start)
+        metrics.inc("watch_cycles_total")
+        metrics.export("watch")
+
+        for section, ministry_code, tender_id in fetched:
+            scheduler.reschedule(
+                (section, ministry_code, tender_id),
+                tenders[section][ministry_code]["tenders"][tender_id],
+                fetched[(section, ministry_code, tender_id)][1],
+            )
+        next_check = scheduler.next_due() or time.time() + MAX_INTERVAL
+        sleep_minutes = max(0.0, next_check - time.time()) / 60
+        print(
+            f"Paused     @ {datetime.now().strftime('%H:%M:%S')} for {sleep_minutes:.1f} Minutes"
+        )
+        next_backup = (datetime.now() + timedelta(minutes=sleep_minutes)).strftime(
+            "%H:%M:%S"
+        )
         print(f"Next Check @ {next_backup}")
-        time.sleep(sleep_minutes * 60)
-        while True:
-            if active_network() == "Wi-Fi":
-                break
-            else:
-                Mbox(
-                    "Ethernet cable is connected",
-                    "Disconnect the ethernet cable to run",
-                    0,
-                )
+        # an edit of the watch list wakes the loop up to pick up the new tenders
+        watch_file.wait(sleep_minutes * 60)
+        gate.wait()
 
 
 if __name__ == "__main__":
-    while True:
-        if active_network() == "Wi-Fi":
-            run_server()
-        else:
-            Mbox(
-                "Ethernet cable is connected",
-                "Disconnect the ethernet cable to run",
-                0,
-            )
+    import argparse
+    import signal
+    import sys
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="run headless over any network, e.g. as a systemd service",
+    )
+    args = parser.parse_args()
+
+    if args.daemon:
+        # pending notifications stay in the mail queue for the next start
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        gate = daemon_gate()
+    else:
+        gate = desktop_gate()
+    gate.wait()
+    run_server(gate)
@@ -0,0 +1,321 @@
+"""Reading and writing the tender snapshots.
+
+A snapshot is either a single JSON document (`*.json`)
+
+    {"opening_tenders": {"<ministry_code>": {"name": ..., "tenders": {...}}, ...},
+     "warranties": {...}, "pre_tenders": [], ...}
+
+or a stream of records, one per line (`*.ndjson`)
+
+    {"section": ..., "ministry_code": ..., "name": ...}
+    {"section": ..., "ministry_code": ..., "tender_id": ..., "tender": {...}}
+
+where every ministry record precedes the records of its tenders, or a SQLite
+store of those records (`*.sqlite`, `*.db`, see `tender_store`).
+"""
+import json
+import os
+import re
+from collections.abc import MutableMapping
+from typing import Any, Iterable, Iterator
+
+SECTIONS = ("opening_tenders", "warranties")
+EMPTY_SECTIONS = (
+    "pre_tenders",
+    "closing_tenders",
+    "winning_bids",
+    "postponement_of_tenders",
+    "company_qualifications",
+)
+
+_STRING = r'("(?:[^"\\]|\\.)*")'
+_TENDER_HEADER = re.compile(
+    rf'{{"section": {_STRING}, "ministry_code": {_STRING}, "tender_id": {_STRING}, '
+    r'"tender": '
+)
+
+
+def is_stream(file: str) -> bool:
+    return file.endswith(".ndjson")
+
+
+def is_store(file: str) -> bool:
+    return file.endswith((".sqlite", ".db"))
+
+
+def ministry_record(section: str, code: str, name: str) -> dict[str, Any]:
+    return {"section": section, "ministry_code": code, "name": name}
+
+
+def tender_record(section: str, code: str, id: str, tender: Any) -> dict[str, Any]:
+    return {"section": section, "ministry_code": code, "tender_id": id, "tender": tender}
+
+
+class RawJSON(str):
+    """An already serialized tender, written out as is"""
+
+
+def dump_record(record: dict[str, Any]) -> str:
+    """Serialize `record` as a single line"""
+    if "tender_id" not in record:
+        return json.dumps(record, ensure_ascii=False)
+
+    head = ", ".join(
+        f"{json.dumps(k)}: {json.dumps(str(record[k]), ensure_ascii=False)}"
+        for k in ("section", "ministry_code", "tender_id")
+    )
+    tender = record["tender"]
+    if not isinstance(tender, RawJSON):
+        tender = json.dumps(tender, ensure_ascii=False)
+    return f'{{{head}, "tender": {tender}}}'
+
+
+def peek(tenders: MutableMapping, id: str) -> Any:
+    """The tender `id` of `tenders`, without decoding it if it wasn't already"""
+    if isinstance(tenders, LazyTenders):
+        return tenders.raw(id)
+    return tenders[id]
+
+
+class LazyTenders(MutableMapping):
+    """The tenders of a ministry from a NDJSON snapshot, each tender is kept in its
+    serialized form until it is first accessed"""
+
+    def __init__(self):
+        self._raw: dict[str, str | None] = {}
+        self._decoded: dict[str, Any] = {}
+
+    def add_raw(self, id: str, raw: str):
+        self._raw[id] = raw
+        self._decoded.pop(id, None)
+
+    def raw(self, id: str) -> RawJSON:
+        if id in self._decoded:
+            return RawJSON(json.dumps(self._decoded[id], ensure_ascii=False))
+        return RawJSON(self._raw[id])
+
+    def __getitem__(self, id):
+        if id not in self._decoded:
+            self._decoded[id] = json.loads(self._raw[id])  # type: ignore
+            self._raw[id] = None
+        return self._decoded[id]
+
+    def __setitem__(self, id, tender):
+        self._raw.setdefault(id, None)
+        self._decoded[id] = tender
+
+    def __delitem__(self, id):
+        del self._raw[id]
+        self._decoded.pop(id, None)
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __len__(self):
+        return len(self._raw)
+
+    def __repr__(self):
+        return f"LazyTenders({len(self)} tenders)"
+
+
+def empty_snapshot() -> dict[str, Any]:
+    return {
+        **{section: {} for section in SECTIONS},
+        **{section: [] for section in EMPTY_SECTIONS},
+    }
+
+
+def fold_records(records: Iterable[dict[str, Any]], omni=None) -> dict[str, Any]:
+    """Rebuild the JSON snapshot layout out of the `records`"""
+    omni = omni or empty_snapshot()
+    for record in records:
+        section = omni[record["section"]]
+        if "tender_id" in record:
+            tender = record["tender"]
+            if isinstance(tender, RawJSON):
+                tender = json.loads(tender)
+            section[record["ministry_code"]]["tenders"][record["tender_id"]] = tender
+        else:
+            section[record["ministry_code"]] = {"name": record["name"], "tenders": {}}
+    return omni
+
+
+def omni_records(omni: dict[str, Any]) -> Iterator[dict[str, Any]]:
+    """The records of a snapshot in the JSON layout, the tenders that were never
+    accessed in a `LazyTenders` are left serialized"""
+    for section in SECTIONS:
+        for code, ministry in omni.get(section, {}).items():
+            yield ministry_record(section, code, ministry["name"])
+
+            for id in (tenders := ministry["tenders"]):
+                yield tender_record(section, code, id, peek(tenders, id))
+
+
+def iter_records(omni: dict[str, Any]) -> Iterator[str]:
+    """The serialized records of a snapshot in the JSON layout"""
+    return map(dump_record, omni_records(omni))
+
+
+def iter_stream(file: str) -> Iterator[dict[str, Any]]:
+    with open(file, "r", encoding="utf-8") as source:
+        for line in source:
+            if line := line.strip():
+                yield json.loads(line)
+
+
+def load_snapshot(file: str) -> dict[str, Any]:
+    """Load a snapshot in the JSON layout, the tenders of a NDJSON snapshot are
+    decoded lazily (see `LazyTenders`).
+
+    Args:
+        file (str): A `*.json` or `*.ndjson` snapshot, or a `*.sqlite` store
+
+    Returns:
+        dict[str, Any]: `{"opening_tenders": {...}, "warranties": {...}, ...}`
+    """
+    if is_store(file):
+        from tender_store import TenderStore
+
+        with TenderStore(file) as store:
+            return store.load()
+    elif not is_stream(file):
+        with open(file, "r", encoding="utf-8") as source:
+            return json.load(source)
+
+    omni = empty_snapshot()
+    with open(file, "r", encoding="utf-8") as source:
+        for line in source:
+            if not (line := line.strip()):
+                continue
+            elif match := _TENDER_HEADER.match(line):
+                section, code, id = map(json.loads, match.groups())
+                omni[section][code]["tenders"].add_raw(id, line[match.end() : -1])
+            else:
+                record = json.loads(line)
+                omni[record["section"]][record["ministry_code"]] = {
+                    "name": record["name"],
+                    "tenders": LazyTenders(),
+                }
+    return omni
+
+
+def write_snapshot(omni: dict[str, Any], file: str):
+    """Atomically replace `file` with `omni`, in the layout its extension calls for"""
+    with SnapshotWriter(file) as target:
+        if is_store(file):
+            for record in omni_records(omni):
+                target.write(record)
+        elif is_stream(file):
+            for line in iter_records(omni):
+                target.write_line(line)
+        else:
+            target.omni = omni
+
+
+def save_tenders(
+    omni: dict[str, Any], file: str, units: Iterable[tuple[str, str, str]]
+):
+    """Store the `(section, ministry_code, tender_id)` `units` of `omni` that changed,
+    a store only upserts those tenders whereas a file is rewritten whole"""
+    if not is_store(file):
+        write_snapshot(omni, file)
+        return
+
+    from tender_store import TenderStore
+
+    with TenderStore(file) as store, store.transaction():
+        for section, code, id in units:
+            store.put_ministry(section, code, omni[section][code]["name"])
+            store.put(section, code, id, peek(omni[section][code]["tenders"], id))
+
+
+class SnapshotWriter:
+    """Writes the records of a crawl to `<file>.partial` and moves it over `file` once
+    done. NDJSON records are written out as soon as they arrive, whereas a JSON
+    snapshot is assembled in memory and written at the end. The records of a store
+    are staged and swapped in at the end (see `tender_store.Staging`), so the store
+    isn't locked while they are written.
+    """
+
+    def __init__(self, file: str):
+        self.file = file
+        self.partial = f"{file}.partial"
+        self.omni = empty_snapshot()
+        self._target = None
+        self._store = None
+        self._staging = None
+
+    def __enter__(self):
+        if is_store(self.file):
+            from tender_store import TenderStore
+
+            self._store = TenderStore(self.file)
+            self._staging = self._store.staging()
+            return self
+
+        self._target = open(self.partial, "w+", encoding="utf-8")
+        return self
+
+    def write(self, record: dict[str, Any]):
+        if self._staging is not None:
+            self._staging.write(record)
+        elif is_stream(self.file):
+            self.write_line(dump_record(record))
+        else:
+            fold_records((record,), self.omni)
+
+    def write_line(self, line: str):
+        self._target.write(line + "\n")  # type: ignore
+        self._target.flush()  # type: ignore
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._store is not None:
+            try:
+                if exc_type is None:
+                    self._staging.swap()  # type: ignore
+            finally:
+                self._store.close()
+            return
+
+        if not is_stream(self.file) and exc_type is None:
+            self._target.write(  # type: ignore
+                json.dumps(self.omni, ensure_ascii=False, default=dict)
+            )
+        self._target.close()  # type: ignore
+        if exc_type is None:
+            os.replace(self.partial, self.file)
+
+
+class Checkpoint:
+    """An append only `<file>.checkpoint` of the tender records fetched by a crawl
+    of `file`, a crawl that dies can be resumed without fetching them again"""
+
+    def __init__(self, file: str):
+        self.file = f"{file}.checkpoint"
+        self._target = None
+
+    def load(self) -> dict[tuple[str, str, str], RawJSON]:
+        """The finished `(section, ministry_code, tender_id)` units and their tenders"""
+        done = {}
+        if not os.path.exists(self.file):
+            return done
+        with open(self.file, "r", encoding="utf-8") as source:
+            for line in source:
+                # a truncated last line is a unit that didn't make it to the disk
+                if (match := _TENDER_HEADER.match(line)) and line.endswith("}\n"):
+                    unit = tuple(map(json.loads, match.groups()))
+                    done[unit] = RawJSON(line[match.end() : -2])
+        return done
+
+    def __enter__(self):
+        self._target = open(self.file, "a", encoding="utf-8")
+        return self
+
+    def mark(self, record: dict[str, Any]):
+        self._target.write(dump_record(record) + "\n")  # type: ignore
+        self._target.flush()  # type: ignore
+
+    def __exit__(self, exc_type, exc, tb):
+        self._target.close()  # type: ignore
+        if exc_type is None:
+            os.remove(self.file)
@@ -1,13 +1,35 @@
+import ast
+import copy
+import html
 import json
+import math
+import os
+import random
 import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 from enum import Enum, unique
-from typing import Any, Iterator
+from typing import Any, Callable, Generator, Iterator
 
 import urllib3 as url
-from bs4 import BeautifulSoup
-
-CAPT_WEBSITE = "https://capt.gov.kw/en"
+from bs4 import BeautifulSoup, FeatureNotFound, SoupStrainer
+
+import metrics
+from capt_http import MAX_IN_FLIGHT, http, scheduler
+from fingerprints import Fingerprints, update
+from snapshot import (
+    Checkpoint,
+    SnapshotWriter,
+    load_snapshot,
+    ministry_record,
+    peek,
+    tender_record,
+)
+
+CAPT_WEBSITE = os.environ.get("CAPT_WEBSITE", "https://capt.gov.kw/en")
 OPEN_TENDER = "tenders/opening-tenders"
 WARRANTY_TENDER = "tenders/warranties"
 
@@ -15,7 +37,13 @@ STANDARD_TIME_FORMAT = "%d %b %Y"
 
 TARGET_FILE = "env/tenders.json"
 
-http = url.PoolManager()
+# Seconds an id list of a ministry is reused before it is fetched again
+ID_CACHE_TTL = 5 * 60
+
+POPUP_CACHE_SIZE = 4096
+
+# Share of the already known tenders that an incremental refresh fetches again
+STALE_FRACTION = 0.1
 Tender = dict[str, Any]
 
 
@@ -64,6 +92,56 @@ class HTTPRequest(str, Enum):
     OPTION = "OPTION"
 
 
+def best_parser(candidates=("lxml", "html.parser")) -> str:
+    """The first of `candidates` BeautifulSoup can find a tree builder for, the
+    pure-Python `html.parser` is always available"""
+    for feature in candidates:
+        try:
+            BeautifulSoup("", feature)
+            return feature
+        except FeatureNotFound:
+            continue
+    return "html.parser"
+
+
+PARSER = best_parser()
+
+
+def has_class(attrs, cls: str) -> bool:
+    value = attrs.get("class") or ""
+    return cls in (value.split() if isinstance(value, str) else value)
+
+
+# Only the subtrees matching these are parsed, everything else in the page is skipped
+CMAP_ONLY = SoupStrainer("optgroup")
+WARRANTY_CMAP_ONLY = SoupStrainer("select", {"name": "ministry_code"})
+TENDER_ONLY = SoupStrainer(
+    lambda name, attrs: name == "div" and has_class(attrs, "tender-info")
+)
+WARRANTY_ONLY = SoupStrainer(
+    lambda name, attrs: (name == "ul" and has_class(attrs, "info-list"))
+    or (name == "div" and has_class(attrs, "tbody"))
+    or (name == "span" and has_class(attrs, "counter"))
+)
+POPUP_ONLY = SoupStrainer("table")
+POPUP_PATH = re.compile(rb"""data-popup-url=["']([^"']*)["']""")
+
+
+def parse_page(markup: bytes | str, only: SoupStrainer | None = None) -> BeautifulSoup:
+    """Parse `markup` with the fastest available `PARSER`, when given `only` the
+    subtrees matching the strainer are kept.
+
+    Args:
+        markup (bytes | str): The HTML page
+        only (SoupStrainer | None): Filters the top most tags that get parsed
+
+    Returns:
+        BeautifulSoup: The parsed (sub)trees
+    """
+    with metrics.timer("parse_seconds"):
+        return BeautifulSoup(markup, PARSER, parse_only=only)
+
+
 def open_tender_cmap() -> Iterator[tuple[str, str]]:
     """Retrieve the ministry code mapping from [CAPT](https://www.cpt.gov.kw), ingnores
     any entry that has either an empty or and empyt value.
@@ -79,8 +157,8 @@ def open_tender_cmap() -> Iterator[tuple[str, str]]:
                 option["value"]: ""
                 if not option.string
                 else "".join(option.string.strip())
-                for optgroup in BeautifulSoup(
-                    http.request(HTTPRequest.GET, CAPT_WEBSITE).data, "html.parser"
+                for optgroup in parse_page(
+                    http.request(HTTPRequest.GET, CAPT_WEBSITE).data, CMAP_ONLY
                 ).find_all("optgroup")
                 for option in optgroup.find_all("option")
             }.items(),
@@ -98,22 +176,58 @@ def open_tender_ids(code: str) -> list:
     Returns:
         list[str]: `[<ids>]`
     """
-    return eval(
-        http.request(HTTPRequest.GET, Template.open_tender_id(code)).data.decode()
+    return decode_ids(
+        http.request(
+            HTTPRequest.GET, Template.open_tender_id(code), max_age=ID_CACHE_TTL
+        ).data
+    )
+
+
+def decode_ids(payload: bytes) -> list:
+    """Decode an id list payload as JSON, falling back to Python literals (e.g. single
+    quoted strings), without evaluating any code
+
+    Args:
+        payload (bytes): The response body of an id list request
+
+    Raises:
+        ValueError: The payload isn't a list
+
+    Returns:
+        list: `[<ids>]`
+    """
+    text = payload.decode()
+    try:
+        ids = json.loads(text)
+    except ValueError:
+        ids = ast.literal_eval(text.strip())
+
+    if not isinstance(ids, (list, tuple)):
+        raise ValueError(f"expected a list of tender ids, found {text[:80]!r}")
+    return list(ids)
+
+
+def fetch_opening_tender(ministry_code: str, tender_id: str) -> url.BaseHTTPResponse:
+    return http.request(
+        HTTPRequest.GET,
+        Template.open_tender(ministry_code, tender_id),
     )
 
 
-def get_opening_tender(ministry_code: str, tender_id: str) -> list[Tender] | Tender:
+def get_opening_tender(
+    ministry_code: str, tender_id: str, popups: "PopupCache | None" = None
+) -> list[Tender] | Tender:
     return opening_tender_from_response(
-        http.request(
-            HTTPRequest.GET,
-            Template.open_tender(ministry_code, tender_id),
-        )
+        fetch_opening_tender(ministry_code, tender_id), popups
     )
 
 
-def opening_tender_from_response(page: url.BaseHTTPResponse) -> list[Tender] | Tender:
-    parser = BeautifulSoup(page.data, "html.parser")
+def opening_tender_from_response(
+    page: url.BaseHTTPResponse, popups: "PopupCache | None" = None
+) -> list[Tender] | Tender:
+    """The tender(s) of an opening tender `page`, the bidding type popups are
+    resolved through `popups` when given and fetched otherwise"""
+    parser = parse_page(page.data, TENDER_ONLY)
     tenders = parser.find_all("div", {"class": "tender-info"})
     res = []
 
@@ -138,7 +252,7 @@ def opening_tender_from_response(page: url.BaseHTTPResponse) -> list[Tender] | T
                 elif k in ("Files", "Insurance Items"):
                     v = add_links(ul)
                 elif k == "Bidding type":
-                    v = process_bidding_type(ul)
+                    v = process_bidding_type(ul, popups)
                 elif k in ("Purchase", "Tender no.", "Organisation"):
                     continue
                 else:
@@ -150,23 +264,106 @@ def opening_tender_from_response(page: url.BaseHTTPResponse) -> list[Tender] | T
     return res[0] if len(res) == 1 else res
 
 
-def process_bidding_type(tag):
+def process_bidding_type(tag, popups: "PopupCache | None" = None):
     list_item = tag.find_next().find_next()
     content = list_item.find()
 
     if not content:
         return list_item.string.strip()
     elif content.name == "button":
-        popup = content["data-popup-url"][4:]  # skipping the `/en/` part
-        ctn = http.request(HTTPRequest.GET, f"{CAPT_WEBSITE}/{popup}")
-        table = BeautifulSoup(ctn.data, "html.parser").find("table")
-        return table_to_aos(table)
+        link = popup_link(content["data-popup-url"])
+        return fetch_popup(link) if popups is None else popups.get(link, fetch_popup)
 
     raise NotImplementedError(
         f"TODO: complete the cases of {content.name} for processing bidding type"
     )
 
 
+def popup_link(path: str) -> str:
+    return f"{CAPT_WEBSITE}/{path[4:]}"  # skipping the `/en/` part
+
+
+def fetch_popups(page: bytes) -> dict[str, bytes]:
+    """The bodies of the bidding type popups linked from a tender `page` by their
+    link, in the order of the page, without parsing it"""
+    links = dict.fromkeys(
+        popup_link(html.unescape(path.decode())) for path in POPUP_PATH.findall(page)
+    )
+    return {link: http.request(HTTPRequest.GET, link).data for link in links}
+
+
+def popup_from_page(data: bytes) -> list[dict[str, str]]:
+    return table_to_aos(parse_page(data, POPUP_ONLY).find("table"))
+
+
+def fetch_popup(link: str) -> list[dict[str, str]]:
+    return popup_from_page(http.request(HTTPRequest.GET, link).data)
+
+
+def popup_memo(pages: dict[str, bytes]) -> "PopupCache":
+    """A memo holding the popups of `pages`, their bodies by link as returned by
+    `fetch_popups`, so that parsing the tender page doesn't fetch them again"""
+    popups = PopupCache()
+    for link, data in pages.items():
+        popups.put(link, popup_from_page(data))
+    return popups
+
+
+class PopupCache:
+    """A thread safe LRU memo of the bidding type popups keyed by their URL, a popup
+    requested while it is being fetched by another thread waits for that fetch
+    instead of issuing its own.
+
+    A memo lives as long as a single crawl (see `save_snapshot`), so a popup that
+    changed is seen by the next crawl. Across crawls, and in the watcher, the popups
+    are revalidated through the `capt_http` response cache.
+    """
+
+    def __init__(self, size=POPUP_CACHE_SIZE):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, list] = OrderedDict()
+        self._pending: dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def get(self, link: str, resolve: Callable[[str], list]) -> list:
+        with self._lock:
+            if link in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(link)
+                return copy.deepcopy(self._entries[link])
+            elif pending := self._pending.get(link):
+                self.hits += 1
+            else:
+                self.misses += 1
+                self._pending[link] = Future()
+
+        if pending:
+            return copy.deepcopy(pending.result())
+
+        try:
+            value = resolve(link)
+        except BaseException as e:
+            with self._lock:
+                self._pending.pop(link).set_exception(e)
+            raise
+
+        with self._lock:
+            self._entries[link] = value
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+            self._pending.pop(link).set_result(value)
+        return copy.deepcopy(value)
+
+    def put(self, link: str, value: list):
+        with self._lock:
+            self._entries[link] = value
+            self._entries.move_to_end(link)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+
 def add_links(tag) -> list[str]:
     return [link.string.strip() for link in tag.find_all("a")]
 
@@ -236,47 +433,280 @@ def table_to_aos(table):
     return [dict([*obj]) for obj in objs]
 
 
-def save_snapshot(file=TARGET_FILE):
-    omni = {
-        "opening_tenders": {
-            code: {
-                "name": name,
-                "tenders": {
-                    id: opening_tender_from_response(
-                        http.request(HTTPRequest.GET, Template.open_tender(code, id))
-                    )
-                    for id in open_tender_ids(code)
-                },
-            }
-            for code, name in open_tender_cmap()
-        },
-        "warranties": {
-            code: {
-                "name": name,
-                "tenders": {
-                    id: warranty_from_page(
-                        BeautifulSoup(
-                            http.request(
-                                HTTPRequest.GET,
-                                Template.warranty_tender(code, id),
-                                headers={"X-Requested-With": "XMLHttpRequest"},
-                            ).data,
-                            "html.parser",
-                        )
-                    )
-                    for id in warranty_tender_ids(code)
-                },
+FAILED = object()
+
+
+def attempt(errors: list[dict], unit: tuple, fetch: Callable, *args) -> Any:
+    """`fetch(*args)`, or `FAILED` after adding the failure of the
+    `(section, ministry_code, tender_id)` `unit` to `errors`. The metrics recorded
+    by `fetch` are labelled with the section and the ministry of `unit`."""
+    section, code, id = unit
+    try:
+        with metrics.labels(section=section, ministry=code):
+            return fetch(*args)
+    except Exception as e:
+        metrics.inc("crawl_failures_total", section=section, ministry=code)
+        errors.append(
+            {
+                "section": section,
+                "ministry_code": code,
+                "tender_id": id,
+                "error": f"{type(e).__name__}: {e}",
             }
-            for code, name in warranty_tender_cmap()
-        },
-        "pre_tenders": [],
-        "closing_tenders": [],
-        "winning_bids": [],
-        "postponement_of_tenders": [],
-        "company_qualifications": [],
+        )
+        print(f"FAILED: {section}::{code}::{id} {type(e).__name__}: {e}")
+        return FAILED
+
+
+def crawl_section(
+    section: str,
+    pool: ThreadPoolExecutor,
+    cmap: Iterator[tuple[str, str]],
+    tender_ids: Callable[[str], list],
+    get_tender: Callable[[str, str], list[Tender] | Tender],
+    previous: dict | None = None,
+    stale_fraction: float = 0.0,
+    checkpoint: Checkpoint | None = None,
+    done: dict[tuple[str, str, str], Any] | None = None,
+    errors: list[dict] | None = None,
+) -> Generator[dict[str, Any], None, dict[str, int]]:
+    """Fetch the tenders of a section through `pool`, the id lists of all the
+    ministries are fetched first followed by the tender pages. `pool.map` keeps the
+    submission order so the records come out in the order of a sequential crawl, each
+    as soon as its page is parsed.
+
+    Tenders found in `previous` are kept as they are except for a random
+    `stale_fraction` of them which is fetched again, ids that are no longer listed
+    are dropped.
+
+    A failing id list keeps the ids of the ministry found in `previous`, a failing
+    tender keeps its `previous` version or is left out. Either way the failure is
+    added to `errors` instead of stopping the crawl.
+
+    Args:
+        section (str): The snapshot section being crawled
+        pool (ThreadPoolExecutor): The workers issuing the requests
+        cmap (Iterator[tuple[str, str]]): `(ministry_code, ministry_name)` pairs
+        tender_ids (Callable[[str], list]): Fetches the tender ids of a ministry
+        get_tender (Callable[[str, str], list[Tender] | Tender]): Fetches a tender
+        previous (dict | None): The section as found in the last snapshot
+        stale_fraction (float): The fraction of the known tenders to fetch again
+        checkpoint (Checkpoint | None): Where the fetched tenders are marked done
+        done (dict | None): The tenders fetched by an interrupted crawl
+        errors (list[dict] | None): Collects the failures
+
+    Yields:
+        dict[str, Any]: The ministry and tender records of the section
+
+    Returns:
+        dict[str, int]: The count of the `added`, `removed`, `refreshed` and
+        `failed` tenders, the added and refreshed ones being the tenders actually
+        fetched, and of the `failed_lists` of ids
+    """
+    previous = previous or {}
+    done = done or {}
+    errors = [] if errors is None else errors
+    ministries = list(cmap)
+    listed = list(
+        pool.map(
+            lambda code: attempt(errors, (section, code, None), tender_ids, code),
+            (code for code, _ in ministries),
+        )
+    )
+    ids = [
+        list(previous.get(code, {}).get("tenders", {}))
+        if code_ids is FAILED
+        else list(map(str, code_ids))
+        for (code, _), code_ids in zip(ministries, listed)
+    ]
+
+    known = {
+        (code, id): ministry["tenders"]
+        for code, ministry in previous.items()
+        for id in ministry["tenders"]
     }
-    with open(file, "w+", encoding="utf-8") as target:
-        target.write(json.dumps(omni, ensure_ascii=False))
+    fresh = [(code, id) for (code, _), code_ids in zip(ministries, ids) for id in code_ids]
+    kept = [unit for unit in fresh if unit in known]
+    stale = set(random.sample(kept, math.ceil(len(kept) * stale_fraction)))
+    units = [unit for unit in fresh if unit not in known or unit in stale]
+    fetched = pool.map(
+        lambda unit: attempt(errors, (section, *unit), get_tender, *unit),
+        (unit for unit in units if (section, *unit) not in done),
+    )
+
+    added = refreshed = failed = 0
+    for (code, name), code_ids in zip(ministries, ids):
+        yield ministry_record(section, code, name)
+        for id in code_ids:
+            if (code, id) in known and (code, id) not in stale:
+                tender = peek(known[(code, id)], id)
+            else:
+                if (section, code, id) in done:
+                    tender = done[(section, code, id)]
+                elif (tender := next(fetched)) is FAILED:
+                    failed += 1
+                    if (code, id) not in known:
+                        continue
+                    tender = peek(known[(code, id)], id)
+                    yield tender_record(section, code, id, tender)
+                    continue
+                elif checkpoint:
+                    checkpoint.mark(tender_record(section, code, id, tender))
+
+                if (code, id) in known:
+                    refreshed += 1
+                else:
+                    added += 1
+            yield tender_record(section, code, id, tender)
+
+    return {
+        "added": added,
+        "removed": len(known.keys() - set(fresh)),
+        "refreshed": refreshed,
+        "failed": failed,
+        "failed_lists": sum(code_ids is FAILED for code_ids in listed),
+    }
+
+
+def crawl(
+    pool: ThreadPoolExecutor,
+    previous: dict,
+    stale_fraction: float,
+    report: dict[str, dict[str, int]],
+    checkpoint: Checkpoint | None = None,
+    done: dict[tuple[str, str, str], Any] | None = None,
+    errors: list[dict] | None = None,
+    popups: PopupCache | None = None,
+) -> Iterator[dict[str, Any]]:
+    """The records of the opening tenders and the warranties, the counts of
+    `crawl_section` are stored in `report` under their section. The bidding type
+    popups are memoized in `popups`."""
+
+    def get_opening_tender_memo(ministry_code: str, tender_id: str):
+        return get_opening_tender(ministry_code, tender_id, popups)
+
+    for section, cmap, tender_ids, get_tender in (
+        ("opening_tenders", open_tender_cmap, open_tender_ids, get_opening_tender_memo),
+        ("warranties", warranty_tender_cmap, warranty_tender_ids, get_warranty),
+    ):
+        report[section] = yield from crawl_section(
+            section,
+            pool,
+            cmap(),
+            tender_ids,
+            get_tender,
+            previous.get(section),
+            stale_fraction,
+            checkpoint,
+            done,
+            errors,
+        )
+
+
+def save_snapshot(
+    file=TARGET_FILE,
+    max_in_flight=1,
+    incremental=False,
+    stale_fraction=STALE_FRACTION,
+    resume=True,
+) -> dict[str, dict[str, int]]:
+    """Crawl the opening tenders and the warranties into `file`, a `*.ndjson` file
+    gets every record written as soon as it is parsed (see `snapshot`).
+
+    Every fetched tender is recorded in a `Checkpoint` of `file` until the crawl
+    completes, the tenders that failed are reported in `<file>.errors.json`. The
+    `fingerprints` of the tenders are stored next to `file`, and the `metrics` of the
+    process are exported to `crawl.prom` and `crawl.json`.
+
+    Args:
+        file (str): The snapshot path. Defaults to `TARGET_FILE`.
+        max_in_flight (int): Number of concurrent requests, capped by
+        `MAX_IN_FLIGHT`. Defaults to a sequential crawl.
+        incremental (bool): Only fetch the tenders missing from the snapshot already
+        in `file` and a `stale_fraction` of the known ones.
+        stale_fraction (float): See `incremental`. Defaults to `STALE_FRACTION`.
+        resume (bool): Skip the tenders in the checkpoint left by an interrupted
+        crawl of `file`. Defaults to `True`.
+
+    Raises:
+        ValueError: `stale_fraction` isn't within [0, 1]
+
+    Returns:
+        dict[str, dict[str, int]]: The `crawl_section` counts of every section
+    """
+    if not 0 <= stale_fraction <= 1:
+        raise ValueError(f"stale_fraction must be within [0, 1], got {stale_fraction}")
+
+    previous = {}
+    if incremental and os.path.exists(file):
+        previous = load_snapshot(file)
+
+    checkpoint = Checkpoint(file)
+    done = checkpoint.load() if resume else {}
+    if not resume and os.path.exists(checkpoint.file):
+        os.remove(checkpoint.file)
+    if done:
+        print(f"Resuming a crawl of {file}, {len(done)} tenders are already done")
+
+    report = {}
+    errors = []
+    # every popup is fetched once per crawl, and again by the next one
+    popups = PopupCache()
+    start = time.perf_counter()
+    previous_fingerprints = Fingerprints(file)
+    fingerprints = Fingerprints(file, load=False)
+    with ThreadPoolExecutor(
+        max(1, min(max_in_flight, MAX_IN_FLIGHT))
+    ) as pool, checkpoint, SnapshotWriter(file) as target:
+        try:
+            for record in crawl(
+                pool, previous, stale_fraction, report, checkpoint, done, errors, popups
+            ):
+                target.write(record)
+                if "tender_id" in record:
+                    update(
+                        fingerprints,
+                        previous_fingerprints,
+                        record["section"],
+                        record["ministry_code"],
+                        record["tender_id"],
+                        record["tender"],
+                    )
+        except BaseException:
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    fingerprints.save()
+
+    error_file = f"{file}.errors.json"
+    if errors:
+        with open(error_file, "w+", encoding="utf-8") as target:
+            json.dump(errors, target, ensure_ascii=False, indent=2)
+    elif os.path.exists(error_file):
+        os.remove(error_file)
+
+    metrics.observe("crawl_seconds", time.perf_counter() - start)
+    for section, counts in report.items():
+        for outcome, count in counts.items():
+            if outcome == "failed_lists":
+                metrics.inc("crawl_id_list_failures_total", count, section=section)
+            else:
+                metrics.inc(
+                    "crawl_tenders_total", count, section=section, outcome=outcome
+                )
+    metrics.export("crawl")
+
+    for section, counts in report.items():
+        print(
+            f"{section}: {counts['added']} added, {counts['removed']} removed, "
+            f"{counts['refreshed']} refreshed, {counts['failed']} failed, "
+            f"{counts['failed_lists']} id lists failed"
+        )
+    print(f"popups: {popups.hits} hits, {popups.misses} misses")
+    print(f"scheduler: {scheduler.stats()}")
+    if errors:
+        print(f"{len(errors)} failures were reported in {error_file}")
+    return report
 
 
 def warranty_tender_cmap() -> Iterator[tuple[str, str]]:
@@ -288,9 +718,9 @@ def warranty_tender_cmap() -> Iterator[tuple[str, str]]:
                 option["value"]: option.string.strip()
                 for option in (
                     options
-                    for optgroup in BeautifulSoup(
+                    for optgroup in parse_page(
                         http.request(HTTPRequest.GET, Template.warranty_page()).data,
-                        "html.parser",
+                        WARRANTY_CMAP_ONLY,
                     )
                     .find("select", {"class": "ajax-select", "name": "ministry_code"})
                     .find_all("optgroup")  # type: ignore
@@ -311,8 +741,10 @@ def warranty_tender_ids(code: str) -> list:
     Returns:
         list: `<ids>`
     """
-    return eval(
-        http.request(HTTPRequest.GET, Template.warranty_tender_id(code)).data.decode()
+    return decode_ids(
+        http.request(
+            HTTPRequest.GET, Template.warranty_tender_id(code), max_age=ID_CACHE_TTL
+        ).data
     )
 
 
@@ -332,19 +764,22 @@ def warranty_tender_contractors(page):
     )
 
 
-def get_warranty(ministry_code: str, tender_id: str) -> Tender:
-    return warranty_from_page(
-        BeautifulSoup(
-            http.request(
-                HTTPRequest.GET,
-                Template.warranty_tender(ministry_code, tender_id),
-                headers={"X-Requested-With": "XMLHttpRequest"},
-            ).data,
-            "html.parser",
-        )
+def fetch_warranty(ministry_code: str, tender_id: str) -> url.BaseHTTPResponse:
+    return http.request(
+        HTTPRequest.GET,
+        Template.warranty_tender(ministry_code, tender_id),
+        headers={"X-Requested-With": "XMLHttpRequest"},
     )
 
 
+def get_warranty(ministry_code: str, tender_id: str) -> Tender:
+    return warranty_from_response(fetch_warranty(ministry_code, tender_id))
+
+
+def warranty_from_response(page: url.BaseHTTPResponse) -> Tender:
+    return warranty_from_page(parse_page(page.data, WARRANTY_ONLY))
+
+
 def warranty_from_page(page):
     lbl, tender_subject = page.find("ul", {"class": "info-list"}).find_all("li")
     res = {lbl.string.strip(): tender_subject.string.strip()}
@@ -361,16 +796,7 @@ def fetch_all_warranties() -> dict:
         code: {
             "name": name,
             "tenders": {
-                id: warranty_from_page(
-                    BeautifulSoup(
-                        http.request(
-                            HTTPRequest.GET,
-                            Template.warranty_tender(code, id),
-                            headers={"X-Requested-With": "XMLHttpRequest"},
-                        ).data,
-                        "html.parser",
-                    )
-                )
+                id: get_warranty(code, id)
                 for id in warranty_tender_ids(code)
             },
         }
@@ -378,9 +804,27 @@ def fetch_all_warranties() -> dict:
     }
 
 
-if __name__ == '__main__':
-    import sys
-    args = sys.argv
-
-    if args and args[1] == 'refresh':
-        save_snapshot()
+if __name__ == "__main__":
+    import argparse
+
+    def fraction(value: str) -> float:
+        res = float(value)
+        if not 0 <= res <= 1:
+            raise argparse.ArgumentTypeError(f"{value} isn't within [0, 1]")
+        return res
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["refresh"])
+    parser.add_argument("max_in_flight", nargs="?", type=int, default=1)
+    parser.add_argument("--incremental", action="store_true")
+    parser.add_argument("--stale-fraction", type=fraction, default=STALE_FRACTION)
+    parser.add_argument("--no-resume", dest="resume", action="store_false")
+    args = parser.parse_args()
+
+    if args.command == "refresh":
+        save_snapshot(
+            max_in_flight=args.max_in_flight,
+            incremental=args.incremental,
+            stale_fraction=args.stale_fraction,
+            resume=args.resume,
+        )
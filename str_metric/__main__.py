@@ -1,35 +1,55 @@
+import argparse
 import sys
 from datetime import datetime
 from statistics import fmean
 
-from html_template import GLOBAL_STYLE
-from levenshtein import (
-    cache_init,
-    color_output,
-    edit_distance,
-    edit_sequence,
-    html_output,
-)
+try:  # python -m str_metric
+    from .batch import iter_distances
+    from .html_template import GLOBAL_STYLE
+    from .levenshtein import (
+        batch_distance,
+        cache_init,
+        color_output,
+        edit_distance,
+        edit_sequence,
+        html_output,
+    )
+except ImportError:  # python str_metric
+    from batch import iter_distances
+    from html_template import GLOBAL_STYLE
+    from levenshtein import (
+        batch_distance,
+        cache_init,
+        color_output,
+        edit_distance,
+        edit_sequence,
+        html_output,
+    )
 
+METHODS = ("bits", "rows", "numpy")
 
-def benchmark(path="bench_sample.txt"):
+
+def benchmark(path="bench_sample.txt", method="bits", rounds=10_000):
+    """Time the distances between the consecutive lines of `path` with `method`,
+    `"numpy"` computes all the pairs of a round as a single `batch_distance`"""
     start = datetime.now()
     durations = []
     high_sep = "━" * 120
     low_sep = "─" * 120
     print(high_sep)
-    print(f"Bench marking using {path}")
+    print(f"Bench marking using {path} with {method}")
     print(low_sep)
     with open(path) as file:
-        lines = file.readlines()
+        lines = [line.strip() for line in file]
+    pairs = list(zip([""] + lines, lines))
 
-    prev = ""
-    for _ in range(10_000):
+    for _ in range(rounds):
         mini_start = datetime.now()
-        for line in lines:
-            line = line.strip()
-            edit_distance(prev, line)
-            prev = line
+        if method == "numpy":
+            batch_distance(pairs, use_numpy=True)
+        else:
+            for prev, line in pairs:
+                edit_distance(prev, line, method=method)
         durations.append(datetime.now() - mini_start)
     duration = datetime.now() - start
 
@@ -39,11 +59,38 @@ def benchmark(path="bench_sample.txt"):
     print(high_sep)
 
 
+def matrix(sources_path: str, targets_path: str, max_distance=None, processes=None):
+    """Print the distances from every line of `sources_path` to every line of
+    `targets_path`, a tab separated row per source line"""
+    with open(sources_path, encoding="utf-8") as file:
+        sources = [line.rstrip("\n") for line in file]
+    with open(targets_path, encoding="utf-8") as file:
+        targets = [line.rstrip("\n") for line in file]
+    for row in iter_distances(sources, targets, max_distance, processes):
+        print(*row, sep="\t")
+
+
 if __name__ == "__main__":
     args = sys.argv[1:]
     if args:
         if args[0] == "bench":
-            benchmark()
+            # bench [bits|rows|numpy] [path]
+            method = args[1] if len(args) > 1 and args[1] in METHODS else "bits"
+            paths = [arg for arg in args[1:] if arg not in METHODS]
+            benchmark(*paths[:1], method=method)
+        elif args[0] == "matrix":
+            parser = argparse.ArgumentParser(prog="python -m str_metric matrix")
+            parser.add_argument("sources")
+            parser.add_argument("targets")
+            parser.add_argument("--max-distance", type=int)
+            parser.add_argument("--processes", type=int)
+            options = parser.parse_args(args[1:])
+            matrix(
+                options.sources,
+                options.targets,
+                options.max_distance,
+                options.processes,
+            )
         else:
             source = args[0]
             target = args[1]
@@ -0,0 +1,123 @@
+"""Distances between many strings at once.
+
+    >>> distance_matrix(["kitten", "sitting"], ["sitting", "kitten", "mitten"])
+    [[3, 0, 1], [0, 3, 3]]
+
+The identical strings of both sides are computed once. The unique sources are
+split in chunks of `chunk_size` handed to a pool of `processes`, each chunk comes
+back as the rows of its sources against every target, and `iter_distances`
+yields the rows in the order of `sources` as soon as their chunk is done.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Iterable, Iterator, Sequence
+
+try:
+    from .levenshtein import bit_distance, bounded_distance
+except ImportError:
+    from levenshtein import bit_distance, bounded_distance
+
+# Sources per task handed to a worker process
+CHUNK_SIZE = 64
+
+# Below that many distances everything runs in the calling process
+POOL_THRESHOLD = 20_000
+
+# The targets of the pool workers, set once per process by `_init_worker`
+_targets: Sequence[str] = ()
+_max_distance: int | None = None
+
+
+def _init_worker(targets: Sequence[str], max_distance: int | None):
+    global _targets, _max_distance
+    _targets, _max_distance = targets, max_distance
+
+
+def distances_to(src: str, targets: Sequence[str], max_distance=None) -> list[int]:
+    """The distances between `src` and every string of `targets`, the ones above
+    `max_distance` are returned as `max_distance + 1`"""
+    if max_distance is None:
+        return [bit_distance(src, tgt) for tgt in targets]
+    return [bounded_distance(src, tgt, max_distance) for tgt in targets]
+
+
+def _rows_for(
+    targets: Sequence[str], max_distance: int | None, chunk: Sequence[str]
+) -> list[list[int]]:
+    return [distances_to(src, targets, max_distance) for src in chunk]
+
+
+def _rows(chunk: Sequence[str]) -> list[list[int]]:
+    """`_rows_for` the targets of a pool worker"""
+    return _rows_for(_targets, _max_distance, chunk)
+
+
+def iter_distances(
+    sources: Iterable[str],
+    targets: Iterable[str],
+    max_distance: int | None = None,
+    processes: int | None = None,
+    chunk_size=CHUNK_SIZE,
+) -> Iterator[list[int]]:
+    """The distances from every string of `sources` to every string of `targets`,
+    one row per source, in order.
+
+    Args:
+        sources (Iterable[str]): The strings of the rows
+        targets (Iterable[str]): The strings of the columns
+        max_distance (int | None): Distances above it are reported as
+        `max_distance + 1`, see `bounded_distance`
+        processes (int | None): Size of the process pool, defaults to the number of
+        CPUs. With 1, or fewer than `POOL_THRESHOLD` distances, no pool is used.
+        chunk_size (int): Unique sources per task. Defaults to `CHUNK_SIZE`.
+
+    Yields:
+        list[int]: The distances of a source to the targets
+    """
+    sources, targets = list(sources), list(targets)
+    unique_sources = list(dict.fromkeys(sources))
+    unique_targets = list(dict.fromkeys(targets))
+    columns = {tgt: k for k, tgt in enumerate(unique_targets)}
+    order = [columns[tgt] for tgt in targets]
+    chunks = [
+        unique_sources[k : k + chunk_size]
+        for k in range(0, len(unique_sources), max(1, chunk_size))
+    ]
+
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or len(unique_sources) * len(unique_targets) < POOL_THRESHOLD:
+        results = map(partial(_rows_for, unique_targets, max_distance), chunks)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(
+            min(processes, len(chunks)),
+            initializer=_init_worker,
+            initargs=(unique_targets, max_distance),
+        )
+        results = pool.map(_rows, chunks)
+
+    # a row is kept until the last source it is the row of
+    last = {src: i for i, src in enumerate(sources)}
+    try:
+        done: dict[str, list[int]] = {}
+        pending = iter(zip(chunks, results))
+        for i, src in enumerate(sources):
+            while src not in done:
+                chunk, rows = next(pending)
+                done.update(zip(chunk, rows))
+            row = done.pop(src) if last[src] == i else done[src]
+            yield [row[k] for k in order]
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+
+def distance_matrix(sources, targets, max_distance=None, processes=None):
+    """All the rows of `iter_distances`"""
+    return list(iter_distances(sources, targets, max_distance, processes))
+
+
+def distance_vector(src: str, targets, max_distance=None, processes=None):
+    """The distances between `src` and every string of `targets`"""
+    return distance_matrix([src], targets, max_distance, processes)[0]
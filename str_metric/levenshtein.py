@@ -1,39 +1,310 @@
+from array import array
+from collections import Counter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Longest `src` the NumPy batches hold in one machine word, longer ones go through
+# `bit_distance`
+WORD_BITS = 64
+
+# `edit_sequence` switches to `linear_edit_sequence` above that many table cells
+LINEAR_CELLS = 1 << 20
+# Subproblems of `linear_edit_sequence` below that many cells are solved with a table
+BASE_CELLS = 1 << 12
+
+
 def cache_init(src, tgt):
-    return [[-1] * (len(src) + 1) for _ in range(len(tgt) + 1)]
+    """A `(len(tgt) + 1) x (len(src) + 1)` cache of -1, the rows are views over a
+    single flat `array` of C ints rather than lists of Python ints"""
+    width = len(src) + 1
+    flat = memoryview(array("i", [-1]) * (width * (len(tgt) + 1)))
+    return [flat[j * width : (j + 1) * width] for j in range(len(tgt) + 1)]
 
 
-def edit_distance(src, tgt, cache=None):
-    if not len(src) * len(tgt):
-        return len(src) * len(tgt)
+def edit_distance(src, tgt, cache=None, method="bits", max_distance=None):
+    """The Levenshtein distance between `src` and `tgt`.
 
-    if not cache:
-        cache = cache_init(src, tgt)
+    Without a `cache` the distance is computed by `bit_distance`, or by keeping only
+    two rows of the table with `method="rows"`. Given one, `cache[j][i]` is filled
+    with the distance between `src[i:]` and `tgt[j:]` for `edit_sequence`, the
+    last row and column are left at -1.
+
+    Given a `max_distance` (and no `cache`), any distance above it is returned as
+    `max_distance + 1`, see `bounded_distance`.
+    """
+    if max_distance is not None and not cache:
+        return bounded_distance(src, tgt, max_distance)
+    if not src or not tgt:
+        return len(src) + len(tgt)
+    if not cache and method == "bits":
+        return bit_distance(src, tgt)
 
     source_len, target_len = len(src), len(tgt)
 
-    def loop(i: int, j: int) -> int:
-        if i >= source_len:
-            return target_len - j
-        elif j >= target_len:
-            return source_len - i
-        elif cache[j][i] >= 0:
-            return cache[j][i]
-        elif src[i] == tgt[j]:
-            cache[j][i] = loop(i + 1, j + 1)
-            return cache[j][i]
+    # the distances of `src[i:]` to `tgt[j + 1:]`, starting from the empty target
+    below = list(range(source_len, -1, -1))
+    for j in range(target_len - 1, -1, -1):
+        row = [0] * source_len + [target_len - j]
+        t = tgt[j]
+        for i in range(source_len - 1, -1, -1):
+            if src[i] == t:
+                row[i] = below[i + 1]
+            else:
+                row[i] = 1 + min(row[i + 1], below[i], below[i + 1])
+        if cache:
+            cache[j][:source_len] = array("i", row[:source_len])
+        below = row
+
+    return below[0]
+
+
+def bounded_distance(src, tgt, max_distance: int) -> int:
+    """The distance between `src` and `tgt` if it is at most `max_distance`, and
+    `max_distance + 1` otherwise.
+
+    The pairs whose lengths or character counts differ by more than
+    `max_distance` are rejected without any table. Past the common prefix and
+    suffix only the cells within `max_distance` of the diagonal are computed
+    (Ukkonen 1985), row by row, stopping at the first row whose cells all exceed
+    `max_distance`.
+    """
+    k = max(0, max_distance)
+    over = k + 1
+    if abs(len(src) - len(tgt)) > k:
+        return over
+
+    start = 0
+    while start < min(len(src), len(tgt)) and src[start] == tgt[start]:
+        start += 1
+    src_end, tgt_end = len(src), len(tgt)
+    while src_end > start and tgt_end > start and src[src_end - 1] == tgt[tgt_end - 1]:
+        src_end -= 1
+        tgt_end -= 1
+    src, tgt = src[start:src_end], tgt[start:tgt_end]
+    n, m = len(src), len(tgt)
+    if not n or not m:
+        return min(n + m, over)
+
+    # every character missing from one side takes an edit of its own
+    missing = Counter(src)
+    missing.subtract(tgt)
+    extra = sum(c for c in missing.values() if c > 0)
+    if max(extra, extra - (n - m)) > k:
+        return over
+    if k >= max(n, m):
+        return min(bit_distance(src, tgt), over)
+
+    # `row[j - i + k + 1]` holds the distance between `src[:i]` and `tgt[:j]`, the
+    # cells out of the band stay at `over`
+    below = [over] * (2 * k + 3)
+    for j in range(min(m, k) + 1):
+        below[j + k + 1] = j
+    for i in range(1, n + 1):
+        row = [over] * (2 * k + 3)
+        c = src[i - 1]
+        for j in range(max(0, i - k), min(m, i + k) + 1):
+            d = j - i + k + 1
+            if j == 0:
+                row[d] = i
+                continue
+            value = min(below[d] + (c != tgt[j - 1]), below[d + 1] + 1, row[d - 1] + 1)
+            row[d] = value if value < over else over
+        if min(row) > k:
+            return over
+        below = row
+    return below[m - n + k + 1]
+
+
+def within_distance(src, tgt, max_distance: int) -> bool:
+    return bounded_distance(src, tgt, max_distance) <= max_distance
+
+
+def match_masks(src) -> dict:
+    """The positions of every character of `src` as a bit vector"""
+    masks = {}
+    for i, c in enumerate(src):
+        masks[c] = masks.get(c, 0) | 1 << i
+    return masks
+
+
+def bit_distance(src, tgt):
+    """The Levenshtein distance between `src` and `tgt`, with a column of the table
+    held as the bit vectors of its vertical deltas (Myers 1999, Hyyrö 2001), an int
+    of `len(src)` bits, so each character of `tgt` costs a few big int operations
+    instead of `len(src)` steps"""
+    if not src or not tgt:
+        return len(src) + len(tgt)
+    return bit_row(src, tgt)[-1]
+
+
+def batch_distance(pairs, use_numpy=None) -> list[int]:
+    """The `edit_distance` of every `(src, tgt)` of `pairs`.
+
+    With NumPy, the pairs whose `src` fits in `WORD_BITS` are run side by side,
+    one `uint64` lane per pair, the other ones go through `bit_distance`. Defaults
+    to using NumPy whenever it is installed.
+    """
+    pairs = list(pairs)
+    if use_numpy is None:
+        use_numpy = np is not None
+    if not use_numpy:
+        return [bit_distance(src, tgt) for src, tgt in pairs]
+    if np is None:
+        raise ImportError("batch_distance(use_numpy=True) needs NumPy")
+
+    res = [0] * len(pairs)
+    lanes = []
+    for k, (src, tgt) in enumerate(pairs):
+        if not src or not tgt or len(src) > WORD_BITS:
+            res[k] = bit_distance(src, tgt)
         else:
-            cache[j][i] = 1 + min(loop(i + 1, j), loop(i, j + 1), loop(i + 1, j + 1))
-            return cache[j][i]
+            lanes.append(k)
+    if lanes:
+        for k, score in zip(lanes, numpy_distance([pairs[k] for k in lanes])):
+            res[k] = score
+    return res
+
+
+def numpy_distance(pairs) -> list[int]:
+    """`bit_distance` of non empty pairs whose `src` fits in `WORD_BITS`, all at once"""
+    alphabet = {}
+    for src, tgt in pairs:
+        for c in (*src, *tgt):
+            alphabet.setdefault(c, len(alphabet))
+
+    lanes = len(pairs)
+    one = np.uint64(1)
+    # the match masks of every lane, one column per character of the alphabet
+    masks = np.zeros((lanes, len(alphabet)), dtype=np.uint64)
+    for k, (src, _) in enumerate(pairs):
+        for c, bits in match_masks(src).items():
+            masks[k, alphabet[c]] = bits
+    src_len = np.array([len(src) for src, _ in pairs], dtype=np.uint64)
+    tgt_len = np.array([len(tgt) for _, tgt in pairs])
+    width = int(tgt_len.max())
+    codes = np.zeros((lanes, width), dtype=np.intp)
+    for k, (_, tgt) in enumerate(pairs):
+        codes[k, : len(tgt)] = [alphabet[c] for c in tgt]
+
+    full = src_len == WORD_BITS
+    mask = np.where(full, ~np.uint64(0), (one << np.where(full, 0, src_len)) - one)
+    last = one << (src_len - one)
+    positive, negative = mask.copy(), np.zeros(lanes, dtype=np.uint64)
+    score = src_len.astype(np.int64)
+    rows = np.arange(lanes)
+    for t in range(width):
+        active = t < tgt_len
+        eq = masks[rows, codes[:, t]]
+        xv = eq | negative
+        xh = ((((eq & positive) + positive) & mask) ^ positive) | eq
+        h_positive = negative | (~(xh | positive) & mask)
+        h_negative = positive & xh
+        score += active * (
+            (h_positive & last != 0).astype(np.int64)
+            - (h_negative & last != 0).astype(np.int64)
+        )
+        h_positive = ((h_positive << one) | one) & mask
+        h_negative = (h_negative << one) & mask
+        positive = np.where(active, h_negative | (~(xv | h_positive) & mask), positive)
+        negative = np.where(active, h_positive & xv, negative)
+    return score.tolist()
+
+
+def bit_row(src, tgt) -> list[int]:
+    """The distances between `src` and every prefix `tgt[:k]` of `tgt`, the scores
+    `bit_distance` goes through"""
+    if not src:
+        return list(range(len(tgt) + 1))
+
+    masks = match_masks(src)
+    mask = (1 << len(src)) - 1
+    last = 1 << (len(src) - 1)
+    positive, negative, score = mask, 0, len(src)
+    res = [score]
+    for c in tgt:
+        eq = masks.get(c, 0)
+        xv = eq | negative
+        xh = ((((eq & positive) + positive) & mask) ^ positive) | eq
+        h_positive = negative | (~(xh | positive) & mask)
+        h_negative = positive & xh
+        if h_positive & last:
+            score += 1
+        elif h_negative & last:
+            score -= 1
+        res.append(score)
+        h_positive = (h_positive << 1 | 1) & mask
+        h_negative = (h_negative << 1) & mask
+        positive = h_negative | (~(xv | h_positive) & mask)
+        negative = h_positive & xv
+    return res
+
+
+def linear_edit_sequence(src, tgt):
+    """An `edit_sequence` in memory linear in the length of the strings, for texts
+    whose table wouldn't fit (Hirschberg 1975).
 
-    return loop(0, 0)
+    The common prefix and suffix are set aside, then `src` is split in halves and
+    `tgt` where the distances of the first half to its prefixes and of the second
+    half to its suffixes add up to the least, each side being aligned on its own
+    down to subproblems of `BASE_CELLS`. The operations may differ from the ones
+    of `edit_sequence` but there are as many of them.
+    """
+    start = 0
+    while start < min(len(src), len(tgt)) and src[start] == tgt[start]:
+        start += 1
+    src_end, tgt_end = len(src), len(tgt)
+    while src_end > start and tgt_end > start and src[src_end - 1] == tgt[tgt_end - 1]:
+        src_end -= 1
+        tgt_end -= 1
+
+    res = []
+    align(src[start:src_end], tgt[start:tgt_end], start, start, res)
+    return res
 
 
-def edit_sequence(src, tgt, cache=None):
+def align(src, tgt, src_offset: int, tgt_offset: int, res: list):
+    """Append the operations turning `src` into `tgt` to `res`, the indices shifted
+    by the offsets of `src` and `tgt` in the strings being aligned"""
+    if len(src) * len(tgt) <= BASE_CELLS or len(src) == 1:
+        for op, y in edit_sequence(src, tgt, method="table"):
+            if op == "insert":
+                res.append((op, y + tgt_offset))
+            elif op == "remove":
+                res.append((op, y + src_offset))
+            else:
+                res.append((op + src_offset, y + tgt_offset))
+        return
+
+    mid = len(src) // 2
+    forward = bit_row(src[:mid], tgt)
+    backward = bit_row(src[mid:][::-1], tgt[::-1])
+    n = len(tgt)
+    split = min(range(n + 1), key=lambda k: forward[k] + backward[n - k])
+    align(src[:mid], tgt[:split], src_offset, tgt_offset, res)
+    align(src[mid:], tgt[split:], src_offset + mid, tgt_offset + split, res)
+
+
+def edit_sequence(src, tgt, cache=None, method=None):
+    """The operations turning `src` into `tgt`: `("insert", i)` of `tgt[i]`,
+    `("remove", j)` of `src[j]` and `(j, i)` replacing `src[j]` with `tgt[i]`.
+
+    The operations are traced back through the table of `edit_distance`, unless
+    the table would hold more than `LINEAR_CELLS` cells or `method="linear"`, in
+    which case `linear_edit_sequence` is used.
+    """
     if not src:
         return list(map(lambda x: ("insert", x), range(len(tgt))))
     if not tgt:
         return list(map(lambda x: ("remove", x), range(len(src))))
 
+    if method is None and not cache:
+        method = "linear" if len(src) * len(tgt) > LINEAR_CELLS else "table"
+    if method == "linear":
+        return linear_edit_sequence(src, tgt)
+
     if not cache:
         cache = cache_init(src, tgt)
         edit_distance(src, tgt, cache)
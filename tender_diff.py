@@ -0,0 +1,215 @@
+"""Structural differences between two versions of a tender.
+
+`diff` walks both versions once and keeps only the paths that changed, the list
+items are matched through a hash of their content instead of pairwise `in`
+checks. The resulting `Change` tree is rendered in a single pass, to html for
+the notification mails (one side at a time, see `render_html`) or to text.
+
+    >>> print(render_text(diff({"a": 1, "b": [1, 2]}, {"a": 2, "b": [2, 3]})))
+    a: 1 -> 2
+    b:
+      - 1
+      + 3
+"""
+import json
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any
+
+from str_metric.levenshtein import html_output
+
+# Longer scalars are highlighted as a whole instead of character by character
+CHAR_DIFF_LIMIT = 400
+
+ADDED = "added"
+REMOVED = "removed"
+MODIFIED = "modified"
+NESTED = "nested"
+
+
+@dataclass
+class Change:
+    """A changed path: an `ADDED` or `REMOVED` value, a `MODIFIED` scalar (or a value
+    whose type changed), or a `NESTED` dict or list holding the changes of its
+    items in `children` as `(key or index, Change)` pairs"""
+
+    kind: str
+    old: Any = None
+    new: Any = None
+    children: list[tuple[Any, "Change"]] = field(default_factory=list)
+
+
+def basic_str(obj) -> str:
+    if isinstance(obj, str):
+        return obj
+    if isinstance(obj, int):
+        return f"{obj:,}"
+    if isinstance(obj, float):
+        return f"{obj:,.3f}"
+    if obj is None:
+        return ""
+    assert False, (
+        "`basic_str` only works on ints, floats, and strings, "
+        f"found type {type(obj)}, {obj = }"
+    )
+
+
+def item_key(item: Any) -> str:
+    """A hashable stand-in of a list item, equal items have equal keys"""
+    return json.dumps(item, ensure_ascii=False, sort_keys=True)
+
+
+def diff(old: Any, new: Any) -> Change | None:
+    """The changes from `old` to `new`, `None` when they are the same"""
+    if isinstance(old, dict) and isinstance(new, dict):
+        children = []
+        for k, v in old.items():
+            if k not in new:
+                children.append((k, Change(REMOVED, old=v)))
+            elif change := diff(v, new[k]):
+                children.append((k, change))
+        children += [(k, Change(ADDED, new=v)) for k, v in new.items() if k not in old]
+        return Change(NESTED, old, new, children) if children else None
+
+    if isinstance(old, list) and isinstance(new, list):
+        return diff_list(old, new)
+
+    if old == new and type(old) is type(new):
+        return None
+    return Change(MODIFIED, old, new)
+
+
+def diff_list(old: list, new: list) -> Change | None:
+    """The items of `old` missing from `new` and the other way around, counting the
+    repeated items"""
+    old_keys = [item_key(item) for item in old]
+    new_keys = [item_key(item) for item in new]
+    if old_keys == new_keys:
+        return None
+
+    in_new = Counter(new_keys)
+    in_old = Counter(old_keys)
+    children = []
+    for i, key in enumerate(old_keys):
+        if in_new[key] > 0:
+            in_new[key] -= 1
+        else:
+            children.append((i, Change(REMOVED, old=old[i])))
+    for i, key in enumerate(new_keys):
+        if in_old[key] > 0:
+            in_old[key] -= 1
+        else:
+            children.append((i, Change(ADDED, new=new[i])))
+
+    if not children:  # the same items in another order
+        return Change(MODIFIED, old, new)
+    return Change(NESTED, old, new, children)
+
+
+def emit_value(parts: list[str], obj: Any, css: str | None = None):
+    """Append the html of `obj` to `parts`, every scalar wrapped in a `css` span"""
+    if isinstance(obj, list):
+        parts.append("<ul>")
+        for item in obj:
+            parts.append("<li>")
+            emit_value(parts, item, css)
+            parts.append("</li>")
+        parts.append("</ul>")
+    elif isinstance(obj, dict):
+        parts.append("<dl>")
+        for k, v in obj.items():
+            parts.append("<dt>")
+            emit_value(parts, k, css)
+            parts.append("</dt><dd>")
+            emit_value(parts, v, css)
+            parts.append("</dd>")
+        parts.append("</dl>")
+    elif css:
+        parts.append(f'<span class="{css}">{basic_str(obj)}</span>')
+    else:
+        parts.append(basic_str(obj))
+
+
+def emit_modified(parts: list[str], change: Change, side: str):
+    old, new = change.old, change.new
+    scalars = (str, int, float)
+    if isinstance(old, scalars) and isinstance(new, scalars):
+        old, new = basic_str(old), basic_str(new)
+        if max(len(old), len(new)) <= CHAR_DIFF_LIMIT:
+            parts.append(html_output(old, new)[side == "new"])
+            return
+    if side == "old":
+        emit_value(parts, change.old, "_removed")
+    else:
+        emit_value(parts, change.new, "_added")
+
+
+def emit_html(parts: list[str], change: Change, side: str):
+    if change.kind == MODIFIED:
+        emit_modified(parts, change, side)
+        return
+
+    ordered = isinstance(change.old, list)
+    parts.append("<ul>" if ordered else "<dl>")
+    for key, child in change.children:
+        if child.kind == (ADDED if side == "old" else REMOVED):
+            continue
+        if ordered:
+            parts.append("<li>")
+        else:
+            css = {ADDED: "_added", REMOVED: "_removed"}.get(child.kind)
+            parts.append("<dt>")
+            emit_value(parts, key, css)
+            parts.append("</dt><dd>")
+
+        if child.kind == ADDED:
+            emit_value(parts, child.new, "_added")
+        elif child.kind == REMOVED:
+            emit_value(parts, child.old, "_removed")
+        else:
+            emit_html(parts, child, side)
+        parts.append("</li>" if ordered else "</dd>")
+    parts.append("</ul>" if ordered else "</dl>")
+
+
+def render_html(change: Change | None, side: str) -> str:
+    """The changed paths of `change` as they are on the `"old"` or the `"new"` side,
+    the values dropped from the old side and the ones added to the new side are
+    highlighted"""
+    if change is None:
+        return ""
+    parts: list[str] = []
+    emit_html(parts, change, side)
+    return "".join(parts)
+
+
+def text_value(obj: Any) -> str:
+    if isinstance(obj, (list, dict)):
+        return json.dumps(obj, ensure_ascii=False)
+    return basic_str(obj)
+
+
+def emit_text(lines: list[str], change: Change, indent: str):
+    for key, child in change.children:
+        label = "" if isinstance(key, int) else f"{basic_str(key)}: "
+        if child.kind == ADDED:
+            lines.append(f"{indent}+ {label}{text_value(child.new)}")
+        elif child.kind == REMOVED:
+            lines.append(f"{indent}- {label}{text_value(child.old)}")
+        elif child.kind == MODIFIED:
+            old, new = text_value(child.old), text_value(child.new)
+            lines.append(f"{indent}{label}{old} -> {new}")
+        else:
+            lines.append(f"{indent}{label.rstrip()}")
+            emit_text(lines, child, indent + "  ")
+
+
+def render_text(change: Change | None) -> str:
+    """The changed paths of `change`, one per line"""
+    if change is None:
+        return ""
+    if change.kind != NESTED:
+        return f"{text_value(change.old)} -> {text_value(change.new)}"
+    lines: list[str] = []
+    emit_text(lines, change, "")
+    return "\n".join(lines)
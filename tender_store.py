@@ -0,0 +1,283 @@
+"""A SQLite tender store, an alternative to the JSON snapshots (see `snapshot`).
+
+Every tender is a row keyed by `(section, ministry_code, tender_id)` holding the
+tender as serialized in the snapshots, so a single changed tender is upserted in
+its own transaction instead of the whole snapshot being rewritten. The rows keep
+the order they were first inserted in, loading and exporting a store gives back
+the snapshot it was imported from.
+
+    python tender_store.py import [snapshot] [store]   e.g. env/tenders.json
+    python tender_store.py export [store] [snapshot]   env/tenders.sqlite
+
+The snapshot functions pick the store for any `*.sqlite` or `*.db` path, pointing
+`TENDERS_FILE` at an imported store switches both the crawler and the watcher. A
+crawl writes its records to temporary tables (see `Staging`) and only locks the
+store for the short transaction moving them over its content, the watcher saving
+its tenders meanwhile waits up to `BUSY_TIMEOUT` seconds for that lock.
+"""
+import json
+import sqlite3
+from typing import Any, Iterable
+
+from snapshot import (
+    LazyTenders,
+    RawJSON,
+    empty_snapshot,
+    load_snapshot,
+    omni_records,
+    write_snapshot,
+)
+
+STORE_FILE = "env/tenders.sqlite"
+
+# Seconds a connection waits for another one to release the write lock
+BUSY_TIMEOUT = 30.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ministries (
+    section TEXT NOT NULL,
+    ministry_code TEXT NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (section, ministry_code)
+);
+CREATE TABLE IF NOT EXISTS tenders (
+    section TEXT NOT NULL,
+    ministry_code TEXT NOT NULL,
+    tender_id TEXT NOT NULL,
+    tender TEXT NOT NULL,
+    PRIMARY KEY (section, ministry_code, tender_id)
+);
+"""
+
+# The same tables, private to the connection, holding the records of a crawl
+STAGING_SCHEMA = """
+CREATE TEMP TABLE IF NOT EXISTS staged_ministries (
+    section TEXT NOT NULL,
+    ministry_code TEXT NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (section, ministry_code)
+);
+CREATE TEMP TABLE IF NOT EXISTS staged_tenders (
+    section TEXT NOT NULL,
+    ministry_code TEXT NOT NULL,
+    tender_id TEXT NOT NULL,
+    tender TEXT NOT NULL,
+    PRIMARY KEY (section, ministry_code, tender_id)
+);
+DELETE FROM staged_ministries;
+DELETE FROM staged_tenders;
+"""
+
+
+def serialize(tender: Any) -> str:
+    if isinstance(tender, RawJSON):
+        return tender
+    return json.dumps(tender, ensure_ascii=False)
+
+
+class TenderStore:
+    """The tenders of `file`, every method commits on its own unless it is called
+    within `transaction()`"""
+
+    def __init__(self, file=STORE_FILE, timeout=BUSY_TIMEOUT):
+        self.file = file
+        self.connection = sqlite3.connect(file, timeout, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.executescript(SCHEMA)
+        self._depth = 0
+
+    def transaction(self):
+        return _Transaction(self)
+
+    def staging(self) -> "Staging":
+        return Staging(self)
+
+    def load(self) -> dict[str, Any]:
+        """The store in the JSON snapshot layout, the tenders are decoded lazily"""
+        omni = empty_snapshot()
+        for section, code, name in self.connection.execute(
+            "SELECT section, ministry_code, name FROM ministries ORDER BY rowid"
+        ):
+            omni[section][code] = {"name": name, "tenders": LazyTenders()}
+        for section, code, id, tender in self.connection.execute(
+            "SELECT section, ministry_code, tender_id, tender FROM tenders "
+            "ORDER BY rowid"
+        ):
+            omni[section][code]["tenders"].add_raw(id, tender)
+        return omni
+
+    def get(self, section: str, code: str, id: str) -> Any:
+        row = self.connection.execute(
+            "SELECT tender FROM tenders "
+            "WHERE section = ? AND ministry_code = ? AND tender_id = ?",
+            (section, code, id),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_ministry(self, section: str, code: str, name: str):
+        with self.transaction():
+            self.connection.execute(
+                "INSERT INTO ministries (section, ministry_code, name) "
+                "VALUES (?, ?, ?) "
+                "ON CONFLICT (section, ministry_code) "
+                "DO UPDATE SET name = excluded.name",
+                (section, code, name),
+            )
+
+    def put(self, section: str, code: str, id: str, tender: Any):
+        """Insert or replace the tender `id`, a replaced tender keeps its position"""
+        with self.transaction():
+            self.connection.execute(
+                "INSERT INTO tenders (section, ministry_code, tender_id, tender) "
+                "VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (section, ministry_code, tender_id) "
+                "DO UPDATE SET tender = excluded.tender",
+                (section, code, id, serialize(tender)),
+            )
+
+    def delete(self, section: str, code: str, id: str):
+        with self.transaction():
+            self.connection.execute(
+                "DELETE FROM tenders "
+                "WHERE section = ? AND ministry_code = ? AND tender_id = ?",
+                (section, code, id),
+            )
+
+    def write(self, record: dict[str, Any]):
+        """Store a snapshot record (see `snapshot.ministry_record`), a tender record
+        must come after the record of its ministry"""
+        if "tender_id" in record:
+            self.put(
+                record["section"],
+                record["ministry_code"],
+                record["tender_id"],
+                record["tender"],
+            )
+        else:
+            self.put_ministry(
+                record["section"], record["ministry_code"], record["name"]
+            )
+
+    def replace(self, records: Iterable[dict[str, Any]] = ()):
+        """Replace the whole content of the store with `records` in one transaction"""
+        with self.transaction():
+            self.clear()
+            for record in records:
+                self.write(record)
+
+    def clear(self):
+        with self.transaction():
+            self.connection.execute("DELETE FROM tenders")
+            self.connection.execute("DELETE FROM ministries")
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class _Transaction:
+    """Commits when the outermost transaction of a store exits cleanly and rolls
+    back otherwise, the nested ones are part of it"""
+
+    def __init__(self, store: TenderStore):
+        self.store = store
+
+    def __enter__(self):
+        if self.store._depth == 0:
+            self.store.connection.execute("BEGIN IMMEDIATE")
+        self.store._depth += 1
+        return self.store
+
+    def __exit__(self, exc_type, exc, tb):
+        self.store._depth -= 1
+        if self.store._depth == 0:
+            self.store.connection.execute("COMMIT" if exc_type is None else "ROLLBACK")
+
+
+class Staging:
+    """Records written to temporary tables of the `store` connection, which don't
+    lock the store, and moved over its content by `swap` in a single transaction.
+
+        staging = store.staging()
+        for record in records:
+            staging.write(record)
+        staging.swap()
+    """
+
+    def __init__(self, store: TenderStore):
+        self.store = store
+        store.connection.executescript(STAGING_SCHEMA)
+
+    def write(self, record: dict[str, Any]):
+        """Stage a snapshot record, see `TenderStore.write`"""
+        if "tender_id" in record:
+            self.store.connection.execute(
+                "INSERT INTO staged_tenders "
+                "(section, ministry_code, tender_id, tender) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (section, ministry_code, tender_id) "
+                "DO UPDATE SET tender = excluded.tender",
+                (
+                    record["section"],
+                    record["ministry_code"],
+                    record["tender_id"],
+                    serialize(record["tender"]),
+                ),
+            )
+        else:
+            self.store.connection.execute(
+                "INSERT INTO staged_ministries (section, ministry_code, name) "
+                "VALUES (?, ?, ?) "
+                "ON CONFLICT (section, ministry_code) "
+                "DO UPDATE SET name = excluded.name",
+                (record["section"], record["ministry_code"], record["name"]),
+            )
+
+    def swap(self):
+        """Replace the content of the store with the staged records"""
+        with self.store.transaction():
+            self.store.clear()
+            self.store.connection.execute(
+                "INSERT INTO ministries (section, ministry_code, name) "
+                "SELECT section, ministry_code, name FROM staged_ministries "
+                "ORDER BY rowid"
+            )
+            self.store.connection.execute(
+                "INSERT INTO tenders (section, ministry_code, tender_id, tender) "
+                "SELECT section, ministry_code, tender_id, tender FROM staged_tenders "
+                "ORDER BY rowid"
+            )
+        self.store.connection.executescript(
+            "DELETE FROM staged_ministries; DELETE FROM staged_tenders;"
+        )
+
+
+def import_snapshot(snapshot_file: str, store_file=STORE_FILE):
+    """Replace the content of `store_file` with the snapshot `snapshot_file`"""
+    with TenderStore(store_file) as store:
+        store.replace(omni_records(load_snapshot(snapshot_file)))
+
+
+def export_snapshot(store_file: str, snapshot_file: str):
+    """Write the content of `store_file` as the snapshot `snapshot_file`"""
+    with TenderStore(store_file) as store:
+        write_snapshot(store.load(), snapshot_file)
+
+
+if __name__ == "__main__":
+    import sys
+
+    from constants import TENDERS_FILE
+
+    args = sys.argv[1:]
+    if args and args[0] == "import":
+        import_snapshot(*args[1:3], *[TENDERS_FILE, STORE_FILE][len(args[1:3]) :])
+    elif args and args[0] == "export":
+        export_snapshot(*args[1:3], *[STORE_FILE, TENDERS_FILE][len(args[1:3]) :])
+    else:
+        print(__doc__)
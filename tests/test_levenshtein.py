@@ -0,0 +1,196 @@
+"""The edit distances and sequences of `str_metric.levenshtein` agree with each
+other and with the memoised recursion they replaced.
+
+    python -m unittest discover -s tests -t .
+"""
+import random
+import sys
+import unittest
+from unittest import mock
+
+from str_metric import levenshtein
+
+ALPHABET = "abcd "
+
+
+def random_pairs(count: int, max_len: int, seed=0) -> list[tuple[str, str]]:
+    """Pairs of strings over a small alphabet, so that they share characters, with
+    the empty and identical pairs among them"""
+    rand = random.Random(seed)
+    pairs = [("", ""), ("", "abc"), ("abc", ""), ("abc", "abc")]
+    for _ in range(count):
+        src = "".join(rand.choices(ALPHABET, k=rand.randint(0, max_len)))
+        tgt = "".join(rand.choices(ALPHABET, k=rand.randint(0, max_len)))
+        pairs.append((src, tgt))
+    return pairs
+
+
+def recursive_cache(src, tgt) -> list[list[int]]:
+    """The cache the recursive `edit_distance` left for `edit_sequence`, only the
+    cells reached from `(0, 0)` are filled"""
+    cache = [[-1] * (len(src) + 1) for _ in range(len(tgt) + 1)]
+
+    def loop(i: int, j: int) -> int:
+        if i >= len(src):
+            return len(tgt) - j
+        elif j >= len(tgt):
+            return len(src) - i
+        elif cache[j][i] < 0:
+            if src[i] == tgt[j]:
+                cache[j][i] = loop(i + 1, j + 1)
+            else:
+                cache[j][i] = 1 + min(
+                    loop(i + 1, j), loop(i, j + 1), loop(i + 1, j + 1)
+                )
+        return cache[j][i]
+
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, 4 * (len(src) + len(tgt)) + 100))
+    try:
+        loop(0, 0)
+    finally:
+        sys.setrecursionlimit(limit)
+    return cache
+
+
+class TableTest(unittest.TestCase):
+    def test_distance(self):
+        for src, tgt in random_pairs(300, 12):
+            with self.subTest(src=src, tgt=tgt):
+                expected = len(src) + len(tgt)
+                if src and tgt:
+                    expected = recursive_cache(src, tgt)[0][0]
+                cache = levenshtein.cache_init(src, tgt)
+                self.assertEqual(levenshtein.edit_distance(src, tgt, cache), expected)
+
+    def test_sequence(self):
+        """The table traceback gives the operations of the recursive cache"""
+        for src, tgt in random_pairs(300, 12):
+            with self.subTest(src=src, tgt=tgt):
+                self.assertEqual(
+                    levenshtein.edit_sequence(src, tgt, method="table"),
+                    levenshtein.edit_sequence(src, tgt, recursive_cache(src, tgt)),
+                )
+
+
+def table_distance(src, tgt) -> int:
+    """The distance read from a full `edit_distance` table"""
+    if not src or not tgt:
+        return len(src) + len(tgt)
+    cache = levenshtein.cache_init(src, tgt)
+    return levenshtein.edit_distance(src, tgt, cache)
+
+
+class DistanceTest(unittest.TestCase):
+    def test_bits_and_rows(self):
+        for src, tgt in random_pairs(500, 80, seed=1):
+            with self.subTest(src=src, tgt=tgt):
+                expected = table_distance(src, tgt)
+                self.assertEqual(levenshtein.bit_distance(src, tgt), expected)
+                self.assertEqual(
+                    levenshtein.edit_distance(src, tgt, method="rows"), expected
+                )
+
+    def test_bit_row(self):
+        """Every prefix of the target, across the word size of the NumPy lanes"""
+        for src, tgt in random_pairs(20, 2 * levenshtein.WORD_BITS, seed=2):
+            with self.subTest(src=src, tgt=tgt):
+                self.assertEqual(
+                    levenshtein.bit_row(src, tgt),
+                    [
+                        levenshtein.edit_distance(src, tgt[:k], method="rows")
+                        for k in range(len(tgt) + 1)
+                    ],
+                )
+
+    def test_batch(self):
+        pairs = random_pairs(200, 80, seed=3)
+        pairs.append(("a" * levenshtein.WORD_BITS, "b" + "a" * levenshtein.WORD_BITS))
+        expected = [table_distance(src, tgt) for src, tgt in pairs]
+        self.assertEqual(levenshtein.batch_distance(pairs, use_numpy=False), expected)
+        if levenshtein.np is None:
+            self.skipTest("NumPy isn't installed")
+        self.assertEqual(levenshtein.batch_distance(pairs, use_numpy=True), expected)
+
+
+class BoundedDistanceTest(unittest.TestCase):
+    def test_bounded(self):
+        """Every bound from 0 to past the distance, through the band, the
+        character counts and the early exits"""
+        for src, tgt in random_pairs(300, 30, seed=6):
+            distance = table_distance(src, tgt)
+            for k in range(distance + 3):
+                with self.subTest(src=src, tgt=tgt, k=k):
+                    expected = min(distance, k + 1)
+                    self.assertEqual(
+                        levenshtein.bounded_distance(src, tgt, k), expected
+                    )
+                    self.assertEqual(
+                        levenshtein.edit_distance(src, tgt, max_distance=k), expected
+                    )
+                    self.assertEqual(
+                        levenshtein.within_distance(src, tgt, k), distance <= k
+                    )
+
+    def test_shared_ends(self):
+        """The common prefix and suffix are set aside before the band"""
+        src, tgt = "prefix-abcd-suffix", "prefix-bcda-suffix"
+        for k in range(4):
+            with self.subTest(k=k):
+                self.assertEqual(
+                    levenshtein.bounded_distance(src, tgt, k), min(2, k + 1)
+                )
+
+
+def apply_sequence(src, tgt, sequence) -> str:
+    """`src` edited by `sequence` the way `color_output` walks it, the stretches
+    between the operations are copied from `src`"""
+    res, i, j = "", 0, 0
+    for op, y in sequence:
+        if op == "insert":
+            res += src[i : i + y - j] + tgt[y]
+            i, j = i + y - j, y + 1
+        elif op == "remove":
+            res += src[i:y]
+            i, j = y + 1, j + y - i
+        else:
+            if op - i != y - j:
+                raise ValueError(f"the replacement {(op, y)} is out of step")
+            res += src[i:op] + tgt[y]
+            i, j = op + 1, y + 1
+    return res + src[i:]
+
+
+class LinearSequenceTest(unittest.TestCase):
+    def assert_sequence(self, src, tgt, sequence):
+        self.assertEqual(len(sequence), table_distance(src, tgt))
+        self.assertEqual(apply_sequence(src, tgt, sequence), tgt)
+
+    def test_table(self):
+        for src, tgt in random_pairs(300, 20, seed=4):
+            with self.subTest(src=src, tgt=tgt):
+                self.assert_sequence(
+                    src, tgt, levenshtein.edit_sequence(src, tgt, method="table")
+                )
+
+    def test_linear(self):
+        for base_cells in (1, 4, 16, levenshtein.BASE_CELLS):
+            with mock.patch.object(levenshtein, "BASE_CELLS", base_cells):
+                for src, tgt in random_pairs(200, 40, seed=base_cells):
+                    with self.subTest(base_cells=base_cells, src=src, tgt=tgt):
+                        self.assert_sequence(
+                            src, tgt, levenshtein.linear_edit_sequence(src, tgt)
+                        )
+
+    def test_switch(self):
+        """`edit_sequence` goes linear above `LINEAR_CELLS`"""
+        src, tgt = "abcabd dcab" * 4, "bcadd cabab" * 4
+        with mock.patch.object(levenshtein, "LINEAR_CELLS", 16), mock.patch.object(
+            levenshtein, "linear_edit_sequence", wraps=levenshtein.linear_edit_sequence
+        ) as linear:
+            self.assert_sequence(src, tgt, levenshtein.edit_sequence(src, tgt))
+        linear.assert_called_once_with(src, tgt)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+"""The pages parsed with `PARSER` and their `SoupStrainer`s give the same results as
+the whole pages parsed with the pure-Python `html.parser`.
+
+    python -m unittest discover -s tests -t .
+"""
+import contextlib
+import os
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import snif_mice
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+STRAINERS = (
+    "CMAP_ONLY",
+    "WARRANTY_CMAP_ONLY",
+    "TENDER_ONLY",
+    "WARRANTY_ONLY",
+    "POPUP_ONLY",
+)
+
+
+def fixture(name: str) -> bytes:
+    with open(os.path.join(FIXTURES_DIR, name), "rb") as file:
+        return file.read()
+
+
+def page(name: str) -> SimpleNamespace:
+    return SimpleNamespace(status=200, data=fixture(name), headers={})
+
+
+class FixtureHTTP:
+    """Answers the requests of the parsers with the saved pages"""
+
+    def __init__(self):
+        self.links = []
+
+    def request(self, method, link, **kwargs):
+        self.links.append(link)
+        if link == snif_mice.CAPT_WEBSITE:
+            return page("ministries.html")
+        elif link == snif_mice.Template.warranty_page():
+            return page("warranty_ministries.html")
+        elif "bidding-type" in link:
+            return page("popup.html")
+        raise AssertionError(f"no saved page for {link}")
+
+
+@contextlib.contextmanager
+def backend(parser: str, strained: bool):
+    """Parse with `parser`, keeping the strainers only when `strained`"""
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(mock.patch.object(snif_mice, "PARSER", parser))
+        stack.enter_context(mock.patch.object(snif_mice, "http", FixtureHTTP()))
+        if not strained:
+            for name in STRAINERS:
+                stack.enter_context(mock.patch.object(snif_mice, name, None))
+        with contextlib.redirect_stdout(open(os.devnull, "w")) as devnull:
+            stack.callback(devnull.close)
+            yield
+
+
+def parse_all() -> dict:
+    return {
+        "ministries": list(snif_mice.open_tender_cmap()),
+        "warranty_ministries": list(snif_mice.warranty_tender_cmap()),
+        "opening_tender": snif_mice.opening_tender_from_response(
+            page("opening_tender.html")
+        ),
+        "warranty": snif_mice.warranty_from_response(page("warranty.html")),
+        "popup": snif_mice.table_to_aos(
+            snif_mice.parse_page(fixture("popup.html"), snif_mice.POPUP_ONLY).find(
+                "table"
+            )
+        ),
+    }
+
+
+class ParserEquivalenceTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with backend("html.parser", strained=False):
+            cls.reference = parse_all()
+
+    def assert_same(self, parser: str):
+        try:
+            snif_mice.BeautifulSoup("", parser)
+        except snif_mice.FeatureNotFound:
+            self.skipTest(f"{parser} isn't installed")
+        with backend(parser, strained=True):
+            results = parse_all()
+        for name, expected in self.reference.items():
+            with self.subTest(name):
+                self.assertEqual(results[name], expected)
+
+    def test_strained_lxml(self):
+        self.assert_same("lxml")
+
+    def test_strained_html_parser(self):
+        self.assert_same("html.parser")
+
+    def test_reference(self):
+        """The saved pages are parsed into the fields the crawler stores"""
+        tender = self.reference["opening_tender"]
+        self.assertEqual(
+            tender["Tender Subject"],
+            "Maintenance & repair of the pumping stations – phase 2",
+        )
+        self.assertEqual(tender["Last date"], "2024-03-05 00:00:00")
+        self.assertEqual(tender["Price"], 1250.0)
+        self.assertEqual(tender["Files"], ["terms.pdf", "drawings.zip"])
+        self.assertEqual(tender["Bidding type"], self.reference["popup"])
+        self.assertNotIn("Tender no.", tender)
+        self.assertEqual(
+            self.reference["popup"][1],
+            {"Classification": "Electrical & mechanical", "Category": "Second"},
+        )
+
+        warranty = self.reference["warranty"]
+        self.assertEqual(warranty["Guarantee Documents"], 3)
+        self.assertEqual(
+            warranty["Contractors"],
+            {"Al-Ahlia Contracting Co.": "Released", "شركة الخليج للتجارة": "Pending"},
+        )
+        self.assertIn(("51", "الهيئة العامة للطرق"), self.reference["ministries"])
+        self.assertEqual(
+            [code for code, _ in self.reference["warranty_ministries"]],
+            ["10", "30", "70"],
+        )
+
+    def test_popup_links(self):
+        """`fetch_popups` requests the popups `process_bidding_type` resolves"""
+        with backend("html.parser", strained=False):
+            snif_mice.opening_tender_from_response(page("opening_tender.html"))
+            parsed = snif_mice.http.links
+        with backend("html.parser", strained=False):
+            snif_mice.fetch_popups(fixture("opening_tender.html"))
+            self.assertEqual(snif_mice.http.links, parsed)
+
+
+if __name__ == "__main__":
+    unittest.main()
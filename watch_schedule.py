@@ -0,0 +1,115 @@
+import heapq
+import itertools
+import time
+from datetime import datetime
+from typing import Any
+
+# Bounds of the time between two checks of a watched tender, in seconds
+MIN_INTERVAL = 2 * 60
+MAX_INTERVAL = 60 * 60
+
+# A tender is checked about this many times over the time left to its deadline
+CHECKS_PER_DEADLINE = 48
+
+# Fields holding the dates `snif_mice.parse_datetime` stored in the snapshot
+DEADLINE_FIELDS = ("Last date", "Initial meeting date")
+
+# How much of the change history is kept at every check
+CHANGE_DECAY = 0.8
+
+Unit = tuple[str, str, str]
+
+
+def deadlines(tender: Any, now: datetime) -> list[float]:
+    """The seconds left to the upcoming deadlines of `tender`"""
+    if isinstance(tender, list):
+        return [left for t in tender for left in deadlines(t, now)]
+    if not isinstance(tender, dict):
+        return []
+
+    res = []
+    for field in DEADLINE_FIELDS:
+        try:
+            left = (datetime.fromisoformat(tender[field]) - now).total_seconds()
+        except (KeyError, TypeError, ValueError):
+            continue
+        if left > 0:
+            res.append(left)
+    return res
+
+
+class PollScheduler:
+    """Gives every watched `(section, ministry_code, tender_id)` its own next check
+    time, kept in a priority queue.
+
+    The interval of a tender is a fraction of the time left to its closest
+    deadline, shortened by the number of its recent changes. The intervals of all
+    the tenders are then stretched evenly whenever their sum of checks per hour
+    exceeds `budget`, so that the checks the dormant tenders give up go to the hot
+    ones. The budget defaults to the baseline of one check per tender every
+    `MAX_INTERVAL`, keeping the request volume of a watch list flat, and is raised
+    with `request_budget` in the config.
+    """
+
+    def __init__(self, budget: float | None = None):
+        self.budget = budget
+        self._queue: list[tuple[float, int, Unit]] = []
+        self._due: dict[Unit, float] = {}
+        self._intervals: dict[Unit, float] = {}
+        self._changes: dict[Unit, float] = {}
+        self._seq = itertools.count()
+
+    def interval(self, unit: Unit, tender: Any, now: float) -> float:
+        """The interval of `unit` before the budget is applied"""
+        interval = MAX_INTERVAL
+        if left := deadlines(tender, datetime.fromtimestamp(now)):
+            interval = min(left) / CHECKS_PER_DEADLINE
+        interval /= 1 + self._changes.get(unit, 0.0)
+        return min(MAX_INTERVAL, max(MIN_INTERVAL, interval))
+
+    def stretch(self) -> float:
+        """The factor applied to the intervals to stay within the budget"""
+        budget = self.budget or len(self._intervals) * 3600 / MAX_INTERVAL
+        per_hour = sum(3600 / interval for interval in self._intervals.values())
+        return max(1.0, per_hour / budget)
+
+    def _push(self, unit: Unit, due: float):
+        self._due[unit] = due
+        heapq.heappush(self._queue, (due, next(self._seq), unit))
+
+    def sync(self, units: list[Unit], now: float | None = None):
+        """Start watching the new `units` right away and forget those not in `units`"""
+        now = time.time() if now is None else now
+        for unit in units:
+            if unit not in self._due:
+                self._intervals[unit] = MAX_INTERVAL
+                self._push(unit, now)
+        for unit in self._due.keys() - set(units):
+            del self._due[unit]
+            self._intervals.pop(unit, None)
+            self._changes.pop(unit, None)
+
+    def pop_due(self, now: float | None = None) -> list[Unit]:
+        """The units whose check is due, in the order they were scheduled"""
+        now = time.time() if now is None else now
+        res = []
+        while self._queue and self._queue[0][0] <= now:
+            due, _, unit = heapq.heappop(self._queue)
+            if self._due.get(unit) == due:  # skips the entries superseded or dropped
+                del self._due[unit]
+                res.append(unit)
+        return res
+
+    def reschedule(
+        self, unit: Unit, tender: Any, changed: bool, now: float | None = None
+    ):
+        """Schedule the next check of `unit` after it was checked"""
+        now = time.time() if now is None else now
+        self._changes[unit] = CHANGE_DECAY * self._changes.get(unit, 0.0) + changed
+        self._intervals[unit] = self.interval(unit, tender, now)
+        self._push(unit, now + self._intervals[unit] * self.stretch())
+
+    def next_due(self) -> float | None:
+        while self._queue and self._due.get(self._queue[0][2]) != self._queue[0][0]:
+            heapq.heappop(self._queue)
+        return self._queue[0][0] if self._queue else None